@@ -1,13 +1,25 @@
 import datetime
-import boto3
 from botocore.exceptions import ClientError
 import uuid
+import time
+import json
+import threading
+from collections import OrderedDict
+import os
+import sys
+
+# run from anywhere, the shared helpers live in the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamo_utils import batch  # noqa: E402
+from dynamo_utils.client import lazy_client  # noqa: E402
 
 '''This file contains examples for using a Session Store Table (Chapter 18 of The DynamoDB Book)'''
 '''The schema for our table is a PK named session_token, and a secondary index of username. Attributes are created_at, expires_at, and TTL(epoch time)'''
 
 
-dynamodb = boto3.client('dynamodb', 'us-east-1')
+dynamodb = lazy_client()
+
+TABLE_NAME = 'chapter_18_session_store'
 
 
 # Here is how we would add a sesson to the table for a user, there is no TTL attribute yet.
@@ -18,7 +30,7 @@ def put_item_into_db(username, session_token=str(uuid.uuid4())):
 
     try:
         result = dynamodb.put_item(
-            TableName='chapter_18_session_store',
+            TableName=TABLE_NAME,
             Item={
                 "session_token": {"S": session_token},
                 "username": {"S": username},
@@ -27,6 +39,8 @@ def put_item_into_db(username, session_token=str(uuid.uuid4())):
             },
             ConditionExpression="attribute_not_exists(session_token)"
         )
+        # a lookup for this token may have been cached as a miss before it existed
+        session_cache.invalidate((TABLE_NAME, session_token))
         # prints results from a succesful add
         print(result)
     except ClientError as e:
@@ -49,26 +63,33 @@ The attribute should be a Number data type containing time in epoch format. Once
 # same as adding an item above, but now we add the TTL attribute in epoch time.
 
 
-def put_item_into_db_with_ttl(username, session_token=str(uuid.uuid4())):
-
+def session_item_with_ttl(username, session_token):
     created_at = datetime.datetime.now()
     expires_at = created_at + datetime.timedelta(days=7)
     epoch = int(expires_at.timestamp())
 
+    return {
+        "session_token": {"S": session_token},
+        "username": {"S": username},
+        "created_at": {"S": created_at.isoformat()},
+        "expires_at": {"S": expires_at.isoformat()},
+        "TTL": {"N": str(epoch)}
+    }
+
+
+def put_item_into_db_with_ttl(username, session_token=str(uuid.uuid4())):
+
     try:
         result = dynamodb.put_item(
-            TableName='chapter_18_session_store',
-            Item={
-                "session_token": {"S": session_token},
-                "username": {"S": username},
-                "created_at": {"S": created_at.isoformat()},
-                "expires_at": {"S": expires_at.isoformat()},
-                "TTL": {"N": str(epoch)}
-            },
+            TableName=TABLE_NAME,
+            Item=session_item_with_ttl(username, session_token),
             ConditionExpression="attribute_not_exists(session_token)"
         )
+        # a lookup for this token may have been cached as a miss before it existed
+        session_cache.invalidate((TABLE_NAME, session_token))
         # prints results from a succesful add
         print(result)
+        return session_token
     except ClientError as e:
         print(e)
 
@@ -85,7 +106,7 @@ def get_tokens_by_username(username):
     # This is a SCAN opeartion but thats okay becuase we're using our secondary index to reduce the number of items to just the ones for this user (which would be 2 in this case.)
     # So even if you have a table with 1 million users as attributes, a scan on the secondary index will still run quick becuase of what I explained above.
     results = dynamodb.query(
-        TableName='chapter_18_session_store',
+        TableName=TABLE_NAME,
         IndexName='username-index',
         ExpressionAttributeValues={
             ':username': {
@@ -100,12 +121,639 @@ def get_tokens_by_username(username):
 def delete_session_tokes_for_user(items):
     for result in items['Items']:
         dynamodb.delete_item(
-            TableName='chapter_18_session_store',
+            TableName=TABLE_NAME,
             Key={
                 'session_token': result['session_token']
             }
         )
+        session_cache.invalidate((TABLE_NAME, token_string(result['session_token'])))
 
 
 '''We pass the results from get_tokens_by_username to delete session tokens for user'''
 # delete_session_tokes_for_user(get_tokens_by_username('TTL_USER'))
+
+
+'''The two functions above only look at the first page of the query (dynamo stops at 1 MB and hands back a LastEvaluatedKey), and they delete
+one token per request. For a user with thousands of sessions that is slow and it misses tokens. The functions below page through the index
+until there is no LastEvaluatedKey left, and delete with BatchWriteItem which takes up to 25 requests at a time.'''
+
+
+def query_username_index(username, attributes=None, index_name='username-index', table_name=TABLE_NAME):
+    '''Pages through the index until there is no LastEvaluatedKey left.
+    Pass attributes to only get those back (ProjectionExpression), it returns the items and the read capacity the query used.'''
+    items = []
+    consumed = 0
+    query_args = {
+        'TableName': table_name,
+        'IndexName': index_name,
+        'ExpressionAttributeValues': {
+            ':username': {
+                'S': username,
+            },
+        },
+        'KeyConditionExpression': 'username = :username',
+        'ReturnConsumedCapacity': 'TOTAL'
+    }
+    if attributes:
+        names = {'#attr{}'.format(i): name for i, name in enumerate(attributes)}
+        query_args['ProjectionExpression'] = ', '.join(names)
+        query_args['ExpressionAttributeNames'] = names
+
+    while True:
+        results = dynamodb.query(**query_args)
+        items.extend(results['Items'])
+        consumed += results.get('ConsumedCapacity', {}).get('CapacityUnits', 0)
+
+        if 'LastEvaluatedKey' not in results:
+            return items, consumed
+        query_args['ExclusiveStartKey'] = results['LastEvaluatedKey']
+
+
+def get_all_tokens_by_username(username, index_name='username-index', table_name=TABLE_NAME):
+    # revoking only needs the key, so that is all we ask for
+    items, consumed = query_username_index(
+        username, ['session_token'], index_name, table_name)
+    return [item['session_token'] for item in items]
+
+
+def batch_write_requests(requests, table_name=TABLE_NAME):
+    '''Sends the write requests 25 at a time. Anything dynamo hands back in UnprocessedItems is retried with an exponential backoff,
+    the backoff matters because unprocessed items usually mean the table is being throttled.'''
+    return batch.batch_write_requests(dynamodb, requests, table_name)
+
+
+def batch_delete_session_tokens(tokens, table_name=TABLE_NAME):
+    try:
+        return batch_write_requests(
+            [{'DeleteRequest': {'Key': {'session_token': token}}} for token in tokens], table_name)
+    finally:
+        # if a later chunk fails the earlier ones are already gone, they must not stay in the cache as valid sessions
+        for token in tokens:
+            session_cache.invalidate((table_name, token_string(token)))
+
+
+def revoke_all_sessions_for_user(username, index_name='username-index', table_name=TABLE_NAME):
+    '''This is "log out everywhere". It returns how many tokens were removed and how long it took. If the table throttles the deletes for longer
+    than the batch helper retries, the report has the number deleted so far and an error, and the remaining tokens are still valid.'''
+    started = time.perf_counter()
+    try:
+        deleted = batch_delete_session_tokens(
+            get_all_tokens_by_username(username, index_name, table_name), table_name)
+    except ClientError as e:
+        print(e)
+        return None
+    except batch.UnprocessedItemsError as e:
+        # the table kept throttling us, some tokens are gone and the rest are still valid
+        print(e)
+        report = {
+            'username': username,
+            'deleted': e.written,
+            'error': str(e),
+            'elapsed_seconds': time.perf_counter() - started
+        }
+        print(report)
+        return report
+
+    report = {
+        'username': username,
+        'deleted': deleted,
+        'elapsed_seconds': time.perf_counter() - started
+    }
+    print(report)
+    return report
+
+
+'''Add a few sessions with put_item_into_db_with_ttl and then revoke them all in one call'''
+# revoke_all_sessions_for_user('TTL_USER')
+
+
+'''Auth middleware checks the session on every request, and a session item never changes until it is deleted or expires. So we can keep
+the items we have already read in memory. The cache is a bounded LRU, each entry lives until the expires_at of its own item, and tokens that
+do not exist are remembered for a few seconds so a bad token can't hammer the table. Deleting tokens in this process drops them from the cache,
+other processes will still see them until the negative TTL / expiry, so keep the cache small if that matters to you.
+The layouts further down keep the same tokens in other tables, so entries are keyed by (table name, token) and a miss in one table never hides
+the session in another.'''
+
+
+class SessionCache:
+
+    def __init__(self, max_size=10000, negative_ttl=5):
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''key is (table name, token). Returns (found, item). item is None for a cached miss.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, item = entry
+                if expires > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, item
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, item, expires):
+        with self._lock:
+            self._entries[key] = (expires, item)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+session_cache = SessionCache()
+
+
+def session_expires_at(item):
+    # the TTL attribute is already epoch time, older items only have the iso string
+    if 'TTL' in item:
+        return int(item['TTL']['N'])
+    return datetime.datetime.fromisoformat(item['expires_at']['S']).timestamp()
+
+
+def get_session(session_token):
+    '''Returns the session item, or None if the token does not exist or has expired.
+    TTL deletes can lag behind by a while, so we check expires_at ourselves instead of trusting that the item is gone.'''
+    found, item = session_cache.get((TABLE_NAME, session_token))
+    if found:
+        return item
+
+    try:
+        result = dynamodb.get_item(
+            TableName=TABLE_NAME,
+            Key={
+                'session_token': {'S': session_token}
+            }
+        )
+    except ClientError as e:
+        print(e)
+        return None
+
+    item = result.get('Item')
+    now = time.time()
+    if item is not None and session_expires_at(item) > now:
+        session_cache.put((TABLE_NAME, session_token), item, session_expires_at(item))
+        return item
+
+    session_cache.put((TABLE_NAME, session_token), None, now + session_cache.negative_ttl)
+    return None
+
+
+'''Call this a few times with a token from the table, only the first call goes to dynamo. session_cache.stats() shows the hit / miss / eviction counters'''
+# get_session('c8698d80-ef05-47b7-9978-70c51c8c8de6')
+# print(session_cache.stats())
+
+
+'''Sliding expiration: every time the user does something we push expires_at / TTL forward. Writing on every request would cost a WCU per request,
+so touch_session only writes once refresh_fraction of the lifetime has gone by (with the defaults, once the session is older than 3.5 days).
+The check happens against the cached item so most touches never leave the process, and the update is conditional so two servers refreshing
+the same session at the same moment only write once, and an expired or deleted session never comes back to life.'''
+
+SESSION_LIFETIME = datetime.timedelta(days=7)
+REFRESH_FRACTION = 0.5
+
+
+def touch_session(session_token, lifetime=SESSION_LIFETIME, refresh_fraction=REFRESH_FRACTION):
+    item = get_session(session_token)
+    if item is None:
+        return None
+
+    now = datetime.datetime.now()
+    # refresh once less than (1 - refresh_fraction) of the lifetime is left
+    threshold = int(now.timestamp() + lifetime.total_seconds()
+                    * (1 - refresh_fraction))
+    if 'TTL' in item and session_expires_at(item) > threshold:
+        return item
+
+    expires_at = now + lifetime
+    try:
+        result = dynamodb.update_item(
+            TableName=TABLE_NAME,
+            Key={
+                'session_token': {'S': session_token}
+            },
+            UpdateExpression="SET expires_at = :expires_at, #ttl = :ttl",
+            ConditionExpression="attribute_exists(session_token) AND (attribute_not_exists(#ttl) OR (#ttl < :threshold AND #ttl > :now))",
+            ExpressionAttributeNames={
+                "#ttl": "TTL"
+            },
+            ExpressionAttributeValues={
+                ":expires_at": {"S": expires_at.isoformat()},
+                ":ttl": {"N": str(int(expires_at.timestamp()))},
+                ":threshold": {"N": str(threshold)},
+                ":now": {"N": str(int(now.timestamp()))}
+            },
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as e:
+        session_cache.invalidate((TABLE_NAME, session_token))
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            # someone else already refreshed it, or it is gone. Either way the table has the answer.
+            return get_session(session_token)
+        print(e)
+        return None
+
+    item = result['Attributes']
+    session_cache.put((TABLE_NAME, session_token), item, session_expires_at(item))
+    return item
+
+
+'''Call this from your middleware with the token on each request, it only writes a couple of times per session lifetime'''
+# touch_session('c8698d80-ef05-47b7-9978-70c51c8c8de6')
+
+
+'''username-index projects every attribute (ALL), so each token we read from it drags the whole session item along.
+Asking for just session_token with a ProjectionExpression shrinks the response, but dynamo still charges RCU on the size of the index items it read.
+To cut the RCU too the index itself has to be smaller: a KEYS_ONLY index only holds username and session_token, which is all revocation needs.
+It is also cheaper to write since every session put is copied into the index. Create it once with add_keys_only_username_index, and once it is
+ACTIVE pass index_name=KEYS_ONLY_USERNAME_INDEX to get_all_tokens_by_username / revoke_all_sessions_for_user.'''
+
+KEYS_ONLY_USERNAME_INDEX = 'username-keys-index'
+
+
+def add_keys_only_username_index():
+    # add ProvisionedThroughput to the Create block if your table is not on demand
+    try:
+        result = dynamodb.update_table(
+            TableName=TABLE_NAME,
+            AttributeDefinitions=[
+                {'AttributeName': 'username', 'AttributeType': 'S'}
+            ],
+            GlobalSecondaryIndexUpdates=[
+                {
+                    'Create': {
+                        'IndexName': KEYS_ONLY_USERNAME_INDEX,
+                        'KeySchema': [
+                            {'AttributeName': 'username', 'KeyType': 'HASH'}
+                        ],
+                        'Projection': {'ProjectionType': 'KEYS_ONLY'}
+                    }
+                }
+            ]
+        )
+        print(result)
+    except ClientError as e:
+        print(e)
+
+
+def measure_username_lookup(username):
+    '''Runs the same lookup three ways and prints the response size and RCU of each, so you can see what each option actually saves.'''
+    report = {}
+    for label, attributes, index_name in [
+            ('full items', None, 'username-index'),
+            ('projected', ['session_token'], 'username-index'),
+            ('keys only index', ['session_token'], KEYS_ONLY_USERNAME_INDEX)]:
+        try:
+            items, consumed = query_username_index(
+                username, attributes, index_name)
+        except ClientError as e:
+            print(e)
+            continue
+        report[label] = {
+            'items': len(items),
+            'bytes': len(json.dumps(items, default=str)),
+            'rcu': consumed
+        }
+    print(report)
+    return report
+
+
+# add_keys_only_username_index()
+# measure_username_lookup('TTL_USER')
+
+
+'''A compact layout for the same sessions. A uuid as a string is 36 bytes, but it is only 16 bytes of data, and an iso timestamp is 26 bytes where
+epoch seconds fit in a handful. The token is stored in the table key AND in the username index so it is paid for twice, and every write
+is rounded up to the next 1 KB, so small items really do count for the table that takes the most writes.
+Dynamo fixes the type of a key attribute when the table is created, so this lives in its own table with session_token as a B (binary) key
+and the same username-index. expires_at is the TTL attribute itself, there is no reason to store it twice.
+The functions still take and return the normal string token, and get_session_compact hands back the item in the same shape get_session does.'''
+
+COMPACT_TABLE_NAME = 'chapter_18_session_store_compact'
+
+
+def encode_session_token(session_token):
+    return uuid.UUID(session_token).bytes
+
+
+def token_string(token_attribute):
+    # turns a session_token attribute from either table back into the usual string form
+    if 'B' in token_attribute:
+        return str(uuid.UUID(bytes=bytes(token_attribute['B'])))
+    return token_attribute['S']
+
+
+def expand_compact_session(item):
+    created_at = datetime.datetime.fromtimestamp(int(item['created_at']['N']))
+    expires_at = datetime.datetime.fromtimestamp(int(item['TTL']['N']))
+    return {
+        'session_token': {'S': token_string(item['session_token'])},
+        'username': item['username'],
+        'created_at': {'S': created_at.isoformat()},
+        'expires_at': {'S': expires_at.isoformat()},
+        'TTL': item['TTL']
+    }
+
+
+def put_item_into_db_compact(username, session_token=None):
+    session_token = session_token or str(uuid.uuid4())
+    created_at = datetime.datetime.now()
+    expires_at = created_at + datetime.timedelta(days=7)
+
+    try:
+        result = dynamodb.put_item(
+            TableName=COMPACT_TABLE_NAME,
+            Item={
+                "session_token": {"B": encode_session_token(session_token)},
+                "username": {"S": username},
+                "created_at": {"N": str(int(created_at.timestamp()))},
+                "TTL": {"N": str(int(expires_at.timestamp()))}
+            },
+            ConditionExpression="attribute_not_exists(session_token)"
+        )
+        session_cache.invalidate((COMPACT_TABLE_NAME, session_token))
+        print(result)
+        return session_token
+    except ClientError as e:
+        print(e)
+
+
+def get_session_compact(session_token):
+    found, item = session_cache.get((COMPACT_TABLE_NAME, session_token))
+    if found:
+        return item
+
+    try:
+        key = encode_session_token(session_token)
+    except ValueError:
+        # whatever the client sent isn't a uuid, so it can't be a session
+        return None
+
+    try:
+        result = dynamodb.get_item(
+            TableName=COMPACT_TABLE_NAME,
+            Key={
+                'session_token': {'B': key}
+            }
+        )
+    except ClientError as e:
+        print(e)
+        return None
+
+    now = time.time()
+    if 'Item' in result and session_expires_at(result['Item']) > now:
+        item = expand_compact_session(result['Item'])
+        session_cache.put((COMPACT_TABLE_NAME, session_token), item, session_expires_at(item))
+        return item
+
+    session_cache.put((COMPACT_TABLE_NAME, session_token), None, now + session_cache.negative_ttl)
+    return None
+
+
+def get_tokens_by_username_compact(username):
+    return [token_string(token) for token in get_all_tokens_by_username(username, table_name=COMPACT_TABLE_NAME)]
+
+
+'''Create the chapter_18_session_store_compact table with session_token as a Binary partition key and a username-index on username, then
+try these out. Revoking works the same as before, just point it at the compact table.'''
+# token = put_item_into_db_compact('TTL_USER')
+# get_session_compact(token)
+# get_tokens_by_username_compact('TTL_USER')
+# revoke_all_sessions_for_user('TTL_USER', table_name=COMPACT_TABLE_NAME)
+
+
+'''Another way to lay the sessions out: no GSI at all. Every session is written twice into the chapter_18_sessions_by_user table (PK / SK keys):
+USER#<username> / SESSION#<token> puts all of a user's sessions in one item collection, so "log out everywhere" is one strongly consistent query
+on the base table instead of a query against an eventually consistent index.
+SESSION#<token> / SESSION#<token> is the pointer item that makes looking a session up by its token a single GetItem.
+The two items are two plain puts, not a transaction: a transactional write costs 2 WCU per item, so a transaction would make every session
+about 4 WCU where the GSI layout pays about 2 (the table write plus the index copy). Two puts cost the same 2 WCU. The pointer goes first with the
+uniqueness condition on the token, just like the original table, and if the collection put then fails the pointer is deleted again so there is
+never a session that revoking can't find.
+
+Migrating:
+1. start writing new sessions with put_item_into_db_user_layout (you can keep writing to the old table too while reads still use it)
+2. run migrate_sessions_to_user_layout, it copies everything in chapter_18_session_store. It only does puts so you can run it again safely
+3. move reads over to get_session_user_layout / revoke_all_sessions_user_layout and stop writing to the old table
+benchmark_session_layouts writes the same sessions to both layouts and compares the write capacity and how long revoking them all takes.'''
+
+USER_LAYOUT_TABLE_NAME = 'chapter_18_sessions_by_user'
+
+
+def user_layout_items(session_item):
+    # the pointer carries the whole session so a lookup by token needs nothing else
+    username = session_item['username']['S']
+    token = session_item['session_token']['S']
+    collection_item = dict(session_item, PK={'S': 'USER#{}'.format(
+        username)}, SK={'S': 'SESSION#{}'.format(token)})
+    pointer_item = dict(session_item, PK={'S': 'SESSION#{}'.format(
+        token)}, SK={'S': 'SESSION#{}'.format(token)})
+    return collection_item, pointer_item
+
+
+def put_item_into_db_user_layout(username, session_token=None, return_consumed_capacity='NONE'):
+    '''Returns the responses of the pointer put and the collection put, or None if the session wasn't written.'''
+    session_token = session_token or str(uuid.uuid4())
+    collection_item, pointer_item = user_layout_items(
+        session_item_with_ttl(username, session_token))
+
+    try:
+        pointer_result = dynamodb.put_item(
+            TableName=USER_LAYOUT_TABLE_NAME,
+            Item=pointer_item,
+            ConditionExpression='attribute_not_exists(PK)',
+            ReturnConsumedCapacity=return_consumed_capacity
+        )
+    except ClientError as e:
+        print(e)
+        return None
+
+    try:
+        collection_result = dynamodb.put_item(
+            TableName=USER_LAYOUT_TABLE_NAME,
+            Item=collection_item,
+            ReturnConsumedCapacity=return_consumed_capacity
+        )
+    except ClientError as e:
+        print(e)
+        # without the collection item revoking would never find this session, so take the pointer back out
+        try:
+            dynamodb.delete_item(TableName=USER_LAYOUT_TABLE_NAME, Key={'PK': pointer_item['PK'], 'SK': pointer_item['SK']})
+        except ClientError as e:
+            print(e)
+        return None
+
+    session_cache.invalidate((USER_LAYOUT_TABLE_NAME, session_token))
+    result = [pointer_result, collection_result]
+    print(result)
+    return result
+
+
+def get_session_user_layout(session_token):
+    found, item = session_cache.get((USER_LAYOUT_TABLE_NAME, session_token))
+    if found:
+        return item
+
+    try:
+        result = dynamodb.get_item(
+            TableName=USER_LAYOUT_TABLE_NAME,
+            Key={
+                'PK': {'S': 'SESSION#{}'.format(session_token)},
+                'SK': {'S': 'SESSION#{}'.format(session_token)}
+            }
+        )
+    except ClientError as e:
+        print(e)
+        return None
+
+    item = result.get('Item')
+    now = time.time()
+    if item is not None and session_expires_at(item) > now:
+        session_cache.put((USER_LAYOUT_TABLE_NAME, session_token), item, session_expires_at(item))
+        return item
+
+    session_cache.put((USER_LAYOUT_TABLE_NAME, session_token), None, now + session_cache.negative_ttl)
+    return None
+
+
+def get_all_tokens_user_layout(username):
+    tokens = []
+    query_args = {
+        'TableName': USER_LAYOUT_TABLE_NAME,
+        'KeyConditionExpression': '#pk = :pk AND begins_with(#sk, :sk)',
+        'ExpressionAttributeNames': {
+            '#pk': 'PK',
+            '#sk': 'SK',
+            '#token': 'session_token'
+        },
+        'ExpressionAttributeValues': {
+            ':pk': {'S': 'USER#{}'.format(username)},
+            ':sk': {'S': 'SESSION#'}
+        },
+        'ProjectionExpression': '#token',
+        'ConsistentRead': True
+    }
+
+    while True:
+        results = dynamodb.query(**query_args)
+        tokens.extend(item['session_token']['S'] for item in results['Items'])
+
+        if 'LastEvaluatedKey' not in results:
+            return tokens
+        query_args['ExclusiveStartKey'] = results['LastEvaluatedKey']
+
+
+def revoke_all_sessions_user_layout(username):
+    started = time.perf_counter()
+    tokens = []
+    try:
+        tokens = get_all_tokens_user_layout(username)
+        requests = []
+        for token in tokens:
+            for pk in ('USER#{}'.format(username), 'SESSION#{}'.format(token)):
+                requests.append({'DeleteRequest': {'Key': {
+                    'PK': {'S': pk},
+                    'SK': {'S': 'SESSION#{}'.format(token)}
+                }}})
+        batch_write_requests(requests, USER_LAYOUT_TABLE_NAME)
+    except ClientError as e:
+        print(e)
+        return None
+    finally:
+        # some chunks may have gone out before a failure, so drop every token whether or not the whole batch made it
+        for token in tokens:
+            session_cache.invalidate((USER_LAYOUT_TABLE_NAME, token))
+
+    report = {
+        'username': username,
+        'deleted': len(tokens),
+        'elapsed_seconds': time.perf_counter() - started
+    }
+    print(report)
+    return report
+
+
+def migrate_sessions_to_user_layout():
+    '''Copies every session in the GSI table into the user layout, one page of the scan at a time.'''
+    copied = 0
+    scan_args = {'TableName': TABLE_NAME}
+
+    while True:
+        results = dynamodb.scan(**scan_args)
+        requests = []
+        for session_item in results['Items']:
+            for item in user_layout_items(session_item):
+                requests.append({'PutRequest': {'Item': item}})
+        batch_write_requests(requests, USER_LAYOUT_TABLE_NAME)
+        copied += len(results['Items'])
+
+        if 'LastEvaluatedKey' not in results:
+            print({'copied': copied})
+            return copied
+        scan_args['ExclusiveStartKey'] = results['LastEvaluatedKey']
+
+
+def benchmark_session_layouts(username='layout_benchmark_user', sessions=100):
+    '''Writes the same number of sessions into both layouts, adds up the WCU dynamo reports for each (the GSI layout includes the index write),
+    then revokes them all and times it. With small session items both layouts should come out at about 2 WCU per session.'''
+    gsi_wcu = 0
+    user_layout_wcu = 0
+
+    for _ in range(sessions):
+        result = dynamodb.put_item(
+            TableName=TABLE_NAME,
+            Item=session_item_with_ttl(username, str(uuid.uuid4())),
+            ConditionExpression="attribute_not_exists(session_token)",
+            ReturnConsumedCapacity='TOTAL'
+        )
+        gsi_wcu += result['ConsumedCapacity']['CapacityUnits']
+
+        results = put_item_into_db_user_layout(
+            username, return_consumed_capacity='TOTAL')
+        user_layout_wcu += sum(result['ConsumedCapacity']['CapacityUnits']
+                               for result in results)
+
+    # the username-index is eventually consistent, give it a moment so both sides revoke every session
+    time.sleep(1)
+    gsi_revoke = revoke_all_sessions_for_user(username)
+    user_layout_revoke = revoke_all_sessions_user_layout(username)
+
+    report = {
+        'sessions': sessions,
+        'gsi_layout': {'wcu': gsi_wcu, 'revoked': gsi_revoke['deleted'], 'revoke_seconds': gsi_revoke['elapsed_seconds']},
+        'user_layout': {'wcu': user_layout_wcu, 'revoked': user_layout_revoke['deleted'], 'revoke_seconds': user_layout_revoke['elapsed_seconds']}
+    }
+    print(report)
+    return report
+
+
+'''Create the chapter_18_sessions_by_user table with a PK / SK string key (no indexes needed) and TTL on the TTL attribute to try these'''
+# put_item_into_db_user_layout('TTL_USER')
+# revoke_all_sessions_user_layout('TTL_USER')
+# migrate_sessions_to_user_layout()
+# benchmark_session_layouts()
@@ -0,0 +1,93 @@
+import asyncio
+import contextlib
+import io
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import chapter_18
+from dynamo_utils.client import get_client
+
+'''asyncio versions of the chapter 18 session store functions.
+boto3 clients block, but they are thread safe, so each call runs on a thread pool and the event loop just awaits it. You can have thousands of
+these coroutines in flight on one loop, at most MAX_CONCURRENCY of them are talking to dynamo at once (that is also the size of the connection pool,
+the default pool of 10 would make everything above 10 wait for a connection).
+The functions call straight into chapter_18.py so the key schema, condition expressions and session cache are the same ones the sync code uses.'''
+
+MAX_CONCURRENCY = 64
+
+executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY)
+
+
+def configure(max_concurrency=MAX_CONCURRENCY, endpoint_url=None):
+    '''Swap the chapter_18 client for one with a connection pool as big as the thread pool. endpoint_url lets you point it at dynamodb local.'''
+    global executor
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    chapter_18.dynamodb = get_client(
+        endpoint_url=endpoint_url, max_pool_connections=max_concurrency)
+
+
+async def _run(function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, function, *args)
+
+
+async def put_item_into_db_with_ttl(username, session_token=None):
+    # the sync version evaluates its default token once, so always pass a fresh one
+    return await _run(chapter_18.put_item_into_db_with_ttl, username, session_token or str(uuid.uuid4()))
+
+
+async def get_session(session_token):
+    return await _run(chapter_18.get_session, session_token)
+
+
+async def get_all_tokens_by_username(username):
+    return await _run(chapter_18.get_all_tokens_by_username, username)
+
+
+async def revoke_all_sessions_for_user(username):
+    return await _run(chapter_18.revoke_all_sessions_for_user, username)
+
+
+'''Create a burst of sessions and look them all up again, all at once on one event loop'''
+
+
+async def login_burst(usernames):
+    tokens = await asyncio.gather(*(put_item_into_db_with_ttl(username) for username in usernames))
+    await asyncio.gather(*(get_all_tokens_by_username(username) for username in usernames))
+    return tokens
+
+
+def benchmark(endpoint_url='http://localhost:8000', sessions=1000):
+    '''Runs the same create + lookup workload through the sync functions one after another and through login_burst.
+    Point it at dynamodb local (or any stand-in) with the chapter_18_session_store table and username-index created.'''
+    configure(endpoint_url=endpoint_url)
+    usernames = ['bench_user_{}'.format(i % 100) for i in range(sessions)]
+
+    # the sync functions print every response, we don't want to time the terminal
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        for username in usernames:
+            chapter_18.put_item_into_db_with_ttl(username, str(uuid.uuid4()))
+            chapter_18.get_all_tokens_by_username(username)
+        sync_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        asyncio.run(login_burst(usernames))
+        async_seconds = time.perf_counter() - started
+
+    report = {
+        'sessions': sessions,
+        'sync_seconds': sync_seconds,
+        'async_seconds': async_seconds,
+        'sync_ops_per_second': 2 * sessions / sync_seconds,
+        'async_ops_per_second': 2 * sessions / async_seconds
+    }
+    print(report)
+    return report
+
+
+if __name__ == '__main__':
+    # python chapter_18_async.py http://localhost:8000 1000
+    benchmark(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
@@ -1,9 +1,23 @@
 import datetime
-import boto3
 from botocore.exceptions import ClientError
 import uuid
 import json
-import ulid
+import os
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import base64
+from decimal import Decimal
+from collections import Counter
+import time
+import sys
+
+# run from anywhere, the shared helpers live in the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamo_utils import batch  # noqa: E402
+from dynamo_utils.client import lazy_client  # noqa: E402
+from dynamo_utils.codec import serialize_item  # noqa: E402
+from dynamo_utils.models import Order, OrderItem  # noqa: E402
+from dynamo_utils.query import iter_query, query_all  # noqa: E402
 
 '''This file contains examples for using a Session Store Table (Chapter 19 of The DynamoDB Book)
 I reccomend looking at the dynamo table after every function run so you get an idea of what it looks like.'''
@@ -18,7 +32,7 @@ I reccomend looking at the dynamo table after every function run so you get an i
 
 '''
 
-dynamodb = boto3.client('dynamodb', 'us-east-1')
+dynamodb = lazy_client()
 
 TABLE_NAME = 'chapter19_ecom_customer_and_items'
 
@@ -122,11 +136,214 @@ def add_customer_and_email_with_addresses(customer_name, customer_email, address
 #     'Jonathan_B', 'JB@gmail.com', address)
 
 
+'''To change one address you don't need to rewrite the whole customer. An update expression can point right at one entry in the Addresses map:
+SET Addresses.#name = :addr adds or replaces it and REMOVE Addresses.#name deletes it. The request only carries that one address, there is no read
+before the write, and two people editing different addresses can't overwrite each other.
+Pass return_changed=True to get back only the address that changed instead of nothing.
+A customer made with add_customer_and_email has no Addresses map yet, and dynamo won't SET a path inside a map that isn't there,
+so the first address creates the map.'''
+
+
+def _customer_key(customer_name):
+    return {
+        'PK': {'S': 'CUSTOMER#{}'.format(customer_name)},
+        'SK': {'S': 'CUSTOMER#{}'.format(customer_name)}
+    }
+
+
+def _update_customer(customer_name, return_consumed_capacity='NONE', **update_args):
+    result = dynamodb.update_item(
+        TableName=TABLE_NAME,
+        Key=_customer_key(customer_name),
+        ReturnConsumedCapacity=return_consumed_capacity,
+        **update_args
+    )
+    print(result)
+    return result
+
+
+def add_customer_address(customer_name, address_name, address, return_changed=False):
+    '''Fails if the customer doesn't exist or already has an address with this name.'''
+    return_values = 'UPDATED_NEW' if return_changed else 'NONE'
+    try:
+        try:
+            result = _update_customer(
+                customer_name,
+                UpdateExpression='SET Addresses.#name = :addr',
+                ConditionExpression='attribute_exists(PK) AND attribute_not_exists(Addresses.#name)',
+                ExpressionAttributeNames={'#name': address_name},
+                ExpressionAttributeValues={':addr': {'M': address}},
+                ReturnValues=return_values
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ValidationException':
+                raise
+            # no Addresses map yet, create it with this address in it
+            result = _update_customer(
+                customer_name,
+                UpdateExpression='SET Addresses = :addresses',
+                ConditionExpression='attribute_exists(PK) AND attribute_not_exists(Addresses)',
+                ExpressionAttributeValues={
+                    ':addresses': {'M': {address_name: {'M': address}}}},
+                ReturnValues=return_values
+            )
+        return result.get('Attributes')
+    except ClientError as e:
+        print(e)
+
+
+def update_customer_address(customer_name, address_name, address, return_changed=False):
+    '''Replaces an address that already exists.'''
+    try:
+        result = _update_customer(
+            customer_name,
+            UpdateExpression='SET Addresses.#name = :addr',
+            ConditionExpression='attribute_exists(Addresses.#name)',
+            ExpressionAttributeNames={'#name': address_name},
+            ExpressionAttributeValues={':addr': {'M': address}},
+            ReturnValues='UPDATED_NEW' if return_changed else 'NONE'
+        )
+        return result.get('Attributes')
+    except ClientError as e:
+        print(e)
+
+
+def delete_customer_address(customer_name, address_name, return_changed=False):
+    '''return_changed gives you back the address that was removed.'''
+    try:
+        result = _update_customer(
+            customer_name,
+            UpdateExpression='REMOVE Addresses.#name',
+            ConditionExpression='attribute_exists(Addresses.#name)',
+            ExpressionAttributeNames={'#name': address_name},
+            ReturnValues='UPDATED_OLD' if return_changed else 'NONE'
+        )
+        return result.get('Attributes')
+    except ClientError as e:
+        print(e)
+
+
+def compare_address_update_cost(customer_name, address_name, address):
+    '''Changes the same address both ways and prints what each cost.
+    Heads up: dynamo charges an UpdateItem on the bigger of the item before and after, so the WCU of the write itself comes out about the same.
+    What the partial update saves is the GetItem you need before a full rewrite (its RCU shows up here), and the size of the request.'''
+    read = dynamodb.get_item(
+        TableName=TABLE_NAME,
+        Key=_customer_key(customer_name),
+        ReturnConsumedCapacity='TOTAL'
+    )
+    customer = read['Item']
+    customer['Addresses'] = {
+        'M': dict(customer.get('Addresses', {}).get('M', {}), **{address_name: {'M': address}})}
+    rewrite = dynamodb.put_item(
+        TableName=TABLE_NAME,
+        Item=customer,
+        ReturnConsumedCapacity='TOTAL'
+    )
+    # the same update update_customer_address sends, called directly so we get the consumed capacity back
+    partial = _update_customer(
+        customer_name,
+        'TOTAL',
+        UpdateExpression='SET Addresses.#name = :addr',
+        ConditionExpression='attribute_exists(Addresses.#name)',
+        ExpressionAttributeNames={'#name': address_name},
+        ExpressionAttributeValues={':addr': {'M': address}}
+    )
+
+    report = {
+        'full_rewrite': {
+            'rcu': read['ConsumedCapacity']['CapacityUnits'],
+            'wcu': rewrite['ConsumedCapacity']['CapacityUnits'],
+            'request_bytes': len(json.dumps(customer))
+        },
+        'partial_update': {
+            'rcu': 0,
+            'wcu': partial['ConsumedCapacity']['CapacityUnits'],
+            'request_bytes': len(json.dumps({address_name: {'M': address}}))
+        }
+    }
+    print(report)
+    return report
+
+
+# add_customer_address('Jonathan_B', 'Vacation', {"Street": {"S": "5 Beach Road"}, "City": {"S": "Taco Beach"}})
+# update_customer_address('Jonathan_B', 'Vacation', {"Street": {"S": "7 Beach Road"}, "City": {"S": "Taco Beach"}}, return_changed=True)
+# delete_customer_address('Jonathan_B', 'Vacation', return_changed=True)
+# compare_address_update_cost('Jonathan_B', 'Business', {"Street": {"S": "2 Taco Way"}, "City": {"S": "Taco City"}})
+
+
+'''Order IDs are ULIDs: 10 characters of millisecond timestamp followed by 16 characters of randomness, so they sort by creation time.
+We make our own instead of using the ulid package so that
+• they are monotonic inside a millisecond. The random part is a random starting point plus a counter, so two orders placed in the same
+  millisecond still sort in the order they were created (and can never collide in this process)
+• they are thread safe without a lock. itertools.count hands out each number exactly once even with many threads calling it
+• they are fast. Only the last 4 characters change from one ID to the next, so the rest is encoded once and reused.
+  new_order_id does about a million a second, new_order_ids(count) is quicker still for bulk loads
+Another process starts from its own random point in an 80 bit space, so collisions across processes aren't a practical concern.'''
+
+CROCKFORD = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+CROCKFORD_PAIRS = [a + b for a in CROCKFORD for b in CROCKFORD]
+
+# top bit left clear so the counter can't run past 80 bits
+_order_id_counter = itertools.count(
+    int.from_bytes(os.urandom(10), 'big') >> 1)
+_order_id_prefix = [(-1, -1, '')]
+
+
+def encode_crockford(value, length):
+    chars = []
+    for _ in range(length):
+        chars.append(CROCKFORD[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def _order_id_prefix_for(ms, high):
+    # never let the timestamp go backwards if the clock does
+    cached = _order_id_prefix[0]
+    ms = max(ms, cached[0])
+    cached = (ms, high, encode_crockford(ms, 10) + encode_crockford(high, 12))
+    _order_id_prefix[0] = cached
+    return cached
+
+
+def new_order_id(next=next, counter=_order_id_counter, time_ns=time.time_ns, cache=_order_id_prefix, pairs=CROCKFORD_PAIRS):
+    # the keyword defaults are just local lookups for speed, don't pass them
+    value = next(counter)
+    ms = time_ns() // 1000000
+    high = value >> 20
+    cached = cache[0]
+    if ms != cached[0] or high != cached[1]:
+        cached = _order_id_prefix_for(ms, high)
+    return cached[2] + pairs[(value >> 10) & 1023] + pairs[value & 1023]
+
+
+def new_order_ids(count):
+    # islice over the counter runs without releasing the GIL, so the whole block of numbers is ours
+    values = list(itertools.islice(_order_id_counter, count))
+    ms = time.time_ns() // 1000000
+    pairs = CROCKFORD_PAIRS
+    cached = _order_id_prefix[0]
+    ids = []
+    for value in values:
+        high = value >> 20
+        if ms != cached[0] or high != cached[1]:
+            cached = _order_id_prefix_for(ms, high)
+            ms = cached[0]
+        ids.append(cached[2] + pairs[(value >> 10) & 1023] +
+                   pairs[value & 1023])
+    return ids
+
+
+# ids = new_order_ids(1000000)
+
+
 '''Now we're going to use dynamo item collections to store ORDER items with the CUSTOMER name.
 We put #ORDER infront of the ORDER ID so that'''
 
 
-def put_order_into_db(customer_id, order_id=str(ulid.ulid())):
+def put_order_into_db(customer_id, order_id=None):
+    order_id = order_id or new_order_id()
     created_at = datetime.datetime.now()
     try:
         result = dynamodb.put_item(
@@ -155,7 +372,8 @@ You will notice the #ORDER is always above the CUSTOMER SK which is intentional'
 
 
 def ret_customer_and_most_recent_orders(customer_id):
-    resp = dynamodb.query(
+    resp = query_all(
+        dynamodb,
         TableName=TABLE_NAME,
         KeyConditionExpression='#pk = :pk',
         ExpressionAttributeNames={
@@ -165,7 +383,7 @@ def ret_customer_and_most_recent_orders(customer_id):
             ':pk': {'S': 'CUSTOMER#{}'.format(customer_id)}
         },
         ScanIndexForward=False,
-        Limit=11
+        max_items=11
     )
     print(resp)
 
@@ -176,11 +394,134 @@ With this we get the customer details, and the order details.'''
 # ret_customer_and_most_recent_orders('Jonathan_B')
 
 
+'''The query above only ever gives you the first 10 orders, and it only works because the CUSTOMER# item happens to sort right after the orders.
+get_order_history_page pages through the orders properly. The first page is still one query: we ask for everything BETWEEN #ORDER# and the
+CUSTOMER# sort key so we get the customer and the newest orders together. Every page after that only reads orders.
+The cursor it gives back is the LastEvaluatedKey as url safe base64, pass it back in to get the next page. It is None on the last page.'''
+
+
+def encode_cursor(last_evaluated_key):
+    raw = json.dumps(last_evaluated_key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    return json.loads(raw)
+
+
+def get_order_history_page(customer_id, cursor=None, page_size=10):
+    pk = 'CUSTOMER#{}'.format(customer_id)
+    query_args = {
+        'TableName': TABLE_NAME,
+        'ExpressionAttributeNames': {
+            '#pk': 'PK',
+            '#sk': 'SK'
+        },
+        'ScanIndexForward': False
+    }
+
+    if cursor is None:
+        query_args['KeyConditionExpression'] = '#pk = :pk AND #sk BETWEEN :orders AND :customer'
+        query_args['ExpressionAttributeValues'] = {
+            ':pk': {'S': pk},
+            ':orders': {'S': '#ORDER#'},
+            ':customer': {'S': pk}
+        }
+        # one extra for the customer item
+        query_args['Limit'] = page_size + 1
+    else:
+        start_key = decode_cursor(cursor)
+        # the cursor comes from the client, don't let it point at somebody else's orders
+        if start_key.get('PK') != {'S': pk}:
+            raise ValueError('cursor does not belong to customer {}'.format(customer_id))
+        query_args['KeyConditionExpression'] = '#pk = :pk AND begins_with(#sk, :orders)'
+        query_args['ExpressionAttributeValues'] = {
+            ':pk': {'S': pk},
+            ':orders': {'S': '#ORDER#'}
+        }
+        query_args['ExclusiveStartKey'] = start_key
+        query_args['Limit'] = page_size
+
+    resp = dynamodb.query(**query_args)
+
+    customer = None
+    orders = []
+    for item in resp['Items']:
+        if item['SK']['S'] == pk:
+            customer = item
+        else:
+            orders.append(item)
+
+    next_key = resp.get('LastEvaluatedKey')
+    if len(orders) > page_size:
+        # the customer item doesn't exist so the first page got an extra order, hand it out on the next page instead
+        orders = orders[:page_size]
+        next_key = {'PK': orders[-1]['PK'], 'SK': orders[-1]['SK']}
+
+    return {
+        'customer': customer,
+        'orders': [Order.from_item(item) for item in orders],
+        'cursor': encode_cursor(next_key) if next_key else None
+    }
+
+
+'''Keep passing the cursor back in until it comes back as None'''
+# page = get_order_history_page('Jonathan_B')
+# print(page)
+# print(get_order_history_page('Jonathan_B', page['cursor']))
+
+
+'''Because the order ID starts with its timestamp, a date range is just a range of sort keys. We turn the start and end into the smallest and
+largest ULID for those milliseconds and let dynamo do a BETWEEN on the customer's item collection, so only orders in the window are read.
+It yields one page of orders at a time, oldest first (newest_first=True flips it).'''
+
+
+def order_sort_key_bounds(start, end):
+    start_ms = int(start.timestamp() * 1000)
+    end_ms = int(end.timestamp() * 1000)
+    return ('#ORDER#{}{}'.format(encode_crockford(start_ms, 10), '0' * 16),
+            '#ORDER#{}{}'.format(encode_crockford(end_ms, 10), 'Z' * 16))
+
+
+def query_orders_between(customer_id, start, end, newest_first=False, page_size=None):
+    lower, upper = order_sort_key_bounds(start, end)
+    query_args = {
+        'TableName': TABLE_NAME,
+        'KeyConditionExpression': '#pk = :pk AND #sk BETWEEN :lower AND :upper',
+        'ExpressionAttributeNames': {
+            '#pk': 'PK',
+            '#sk': 'SK'
+        },
+        'ExpressionAttributeValues': {
+            ':pk': {'S': 'CUSTOMER#{}'.format(customer_id)},
+            ':lower': {'S': lower},
+            ':upper': {'S': upper}
+        },
+        'ScanIndexForward': not newest_first
+    }
+    if page_size:
+        query_args['Limit'] = page_size
+
+    while True:
+        resp = dynamodb.query(**query_args)
+        yield [Order.from_item(item) for item in resp['Items']]
+
+        if 'LastEvaluatedKey' not in resp:
+            return
+        query_args['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+# for page in query_orders_between('Jonathan_B', datetime.datetime(2020, 3, 1), datetime.datetime(2020, 3, 31, 23, 59, 59)):
+#     print(page)
+
+
 '''Now we need to add the order items.
 We Will add a Global secondary index with a Sort Key using the OrderID. Since our order items, and our orders will have the same index of GSI1PK we can group them togeather'''
 
 
-def put_order_into_db_with_GSI(customer_id, order_id=str(ulid.ulid())):
+def put_order_into_db_with_GSI(customer_id, order_id=None):
+    order_id = order_id or new_order_id()
     created_at = datetime.datetime.now()
     try:
         result = dynamodb.put_item(
@@ -193,8 +534,8 @@ def put_order_into_db_with_GSI(customer_id, order_id=str(ulid.ulid())):
                 "status": {"S": 'SHIPPED'},
                 "Amount": {"N": '67.43'},
                 "number_items": {"N": '7'},
-                "GSI1PK": {"S": 'ORDER# {}'.format(order_id)},
-                "GSI1SK": {"S": 'ORDER# {}'.format(order_id)}
+                "GSI1PK": {"S": 'ORDER#{}'.format(order_id)},
+                "GSI1SK": {"S": 'ORDER#{}'.format(order_id)}
             }
         )
         # prints results from a succesful add
@@ -218,7 +559,7 @@ def put_order_items(order_id, item_id):
             Item={
                 'PK': {'S': 'ORDER#{0}#ITEM#{1}'.format(order_id, item_id)},
                 'SK': {'S': 'ORDER#{0}#ITEM#{1}'.format(order_id, item_id)},
-                "order_id": {"S": '88da49e72b80'},
+                "order_id": {"S": order_id},
                 "item_id": {"S": item_id},
                 "Description": {"S": 'Tacos & Bells'},
                 "Price": {"N": '67.43'},
@@ -241,7 +582,8 @@ remember get an existing order id from dynamo'''
 
 
 def query_items_by_order(order_id):
-    results = dynamodb.query(
+    results = query_all(
+        dynamodb,
         TableName=TABLE_NAME,
         IndexName='GSI1PK-GSI1SK-index',
         ExpressionAttributeValues={
@@ -255,3 +597,278 @@ def query_items_by_order(order_id):
 
 
 # query_items_by_order('01ECGPW001CM7KKWW13X1P2KV7')
+
+
+'''put_order_into_db_with_GSI used to write its GSI1 keys as 'ORDER# <id>' (with a space) while the items use 'ORDER#<id>', so the query above
+never found the order itself. With the keys matching, the order and all of its items share GSI1PK, and because 'ITEM#' sorts before 'ORDER#'
+the order comes back last. get_order_with_items reads every page of that one query and hands back the order and its items.
+Orders written before the fix still have the space, run backfill_order_gsi_keys once to rewrite them.'''
+
+
+def get_order_with_items(order_id):
+    query_args = {
+        'TableName': TABLE_NAME,
+        'IndexName': 'GSI1PK-GSI1SK-index',
+        'ExpressionAttributeValues': {
+            ':GSI1PK': {
+                'S': 'ORDER#{}'.format(order_id),
+            },
+        },
+        'KeyConditionExpression': 'GSI1PK = :GSI1PK'
+    }
+    order = None
+    items = []
+
+    for item in iter_query(dynamodb, **query_args):
+        if item['GSI1SK']['S'].startswith('ITEM#'):
+            items.append(OrderItem.from_item(item))
+        else:
+            order = Order.from_item(item)
+    return {'order': order, 'items': items}
+
+
+def backfill_order_gsi_keys():
+    '''Finds orders that still have 'ORDER# <id>' GSI keys and rewrites them. Safe to run more than once.'''
+    fixed = 0
+    scan_args = {
+        'TableName': TABLE_NAME,
+        'FilterExpression': 'begins_with(GSI1PK, :old)',
+        'ProjectionExpression': 'PK, SK, order_id',
+        'ExpressionAttributeValues': {':old': {'S': 'ORDER# '}}
+    }
+
+    while True:
+        results = dynamodb.scan(**scan_args)
+        for item in results['Items']:
+            order_id = item['order_id']['S']
+            try:
+                dynamodb.update_item(
+                    TableName=TABLE_NAME,
+                    Key={'PK': item['PK'], 'SK': item['SK']},
+                    UpdateExpression='SET GSI1PK = :key, GSI1SK = :key',
+                    ConditionExpression='GSI1PK = :old',
+                    ExpressionAttributeValues={
+                        ':key': {'S': 'ORDER#{}'.format(order_id)},
+                        ':old': {'S': 'ORDER# {}'.format(order_id)}
+                    }
+                )
+                fixed += 1
+            except ClientError as e:
+                print(e)
+
+        if 'LastEvaluatedKey' not in results:
+            print({'fixed': fixed})
+            return fixed
+        scan_args['ExclusiveStartKey'] = results['LastEvaluatedKey']
+
+
+# backfill_order_gsi_keys()
+# get_order_with_items('01ECGPW001CM7KKWW13X1P2KV7')
+
+
+'''Placing an order with the functions above is one put for the order and then one put per item, one after another, and if something fails half way
+you are left with part of an order. place_order writes the order and all of its items together.
+Up to 100 items fit in one TransactWriteItems call, so a normal sized order is one request that either fully happens or doesn't.
+Bigger orders go out as BatchWriteItem calls of 25 items (retrying anything unprocessed) and the order item is written last,
+so the order only shows up once all of its items are there. If that path fails part way the items already written have no order, the
+printed error names the order id so they can be cleaned up.
+Neither a transaction nor a batch can write the same key twice, so an order that lists the same item_id twice is refused before anything is sent.
+items is a list of dicts like {'item_id': '199997642', 'description': 'Tacos & Bells', 'price': '67.43'}'''
+
+TRANSACTION_ITEM_LIMIT = 100
+
+
+def batch_write_requests(requests):
+    return batch.batch_write_requests(dynamodb, requests, TABLE_NAME)
+
+
+def order_item_for(order_id, item):
+    return serialize_item({
+        'PK': 'ORDER#{0}#ITEM#{1}'.format(order_id, item['item_id']),
+        'SK': 'ORDER#{0}#ITEM#{1}'.format(order_id, item['item_id']),
+        "order_id": order_id,
+        "item_id": item['item_id'],
+        "Description": item['description'],
+        "Price": Decimal(str(item['price'])),
+        "GSI1PK": 'ORDER#{0}'.format(order_id),
+        "GSI1SK": 'ITEM#{0}'.format(item['item_id'])
+    })
+
+
+def place_order(customer_id, items, status='PLACED'):
+    duplicates = sorted(item_id for item_id, count in Counter(item['item_id'] for item in items).items() if count > 1)
+    if duplicates:
+        print('item ids {} are in the order more than once, each item can only be listed once'.format(duplicates))
+        return None
+
+    order_id = new_order_id()
+    created_at = datetime.datetime.now()
+    order = serialize_item({
+        'PK': 'CUSTOMER#{}'.format(customer_id),
+        'SK': '#ORDER#{}'.format(order_id),
+        "order_id": order_id,
+        "created_at": created_at.isoformat(),
+        "status": status,
+        "Amount": sum(Decimal(str(item['price'])) for item in items),
+        "number_items": len(items),
+        "GSI1PK": 'ORDER#{}'.format(order_id),
+        "GSI1SK": 'ORDER#{}'.format(order_id)
+    })
+    order_items = [order_item_for(order_id, item) for item in items]
+
+    try:
+        if len(order_items) + 1 <= TRANSACTION_ITEM_LIMIT:
+            result = dynamodb.transact_write_items(
+                TransactItems=[
+                    {
+                        'Put': {
+                            'TableName': TABLE_NAME,
+                            'Item': order,
+                            'ConditionExpression': 'attribute_not_exists(PK)'
+                        }
+                    }
+                ] + [{'Put': {'TableName': TABLE_NAME, 'Item': item}} for item in order_items]
+            )
+        else:
+            try:
+                batch_write_requests([{'PutRequest': {'Item': item}}
+                                     for item in order_items])
+                result = dynamodb.put_item(
+                    TableName=TABLE_NAME,
+                    Item=order,
+                    ConditionExpression='attribute_not_exists(PK)'
+                )
+            except (ClientError, batch.UnprocessedItemsError) as e:
+                # some or all of the items are in the table without their order
+                print({'order_id': order_id, 'partially_written': True, 'error': str(e)})
+                return None
+        print(result)
+        return order_id
+    except ClientError as e:
+        print(e)
+
+
+# place_order('Jonathan_B', [{'item_id': '199997642', 'description': 'Tacos & Bells', 'price': '12.50'},
+#                            {'item_id': '199997643', 'description': 'Baja Blast', 'price': '2.25'}])
+
+
+'''Bulk onboarding. add_customer_and_email is one transaction per customer, which is far too slow for an import of hundreds of thousands.
+A transaction can hold TRANSACTION_ITEM_LIMIT items and each customer is two (the customer and the email), so we pack 50 customers into each one.
+If any username or email already exists dynamo cancels the whole transaction, but CancellationReasons lines up with the items we sent,
+so we can tell exactly which customers collided. Those go in the report and everybody else in the chunk is sent again.
+Chunks run on a thread pool. The report has the number created, the conflicts (username or email already taken, or repeated inside the import)
+and anything that failed for another reason.'''
+
+CUSTOMERS_PER_TRANSACTION = TRANSACTION_ITEM_LIMIT // 2
+MAX_TRANSACTION_RETRIES = 5
+
+
+def customer_transact_items(customer_name, customer_email):
+    return [
+        {
+            'Put': {
+                'TableName': TABLE_NAME,
+                'Item': serialize_item({
+                    'PK': 'CUSTOMER#{}'.format(customer_name),
+                    'SK': 'CUSTOMER#{}'.format(customer_name),
+                    'Username': customer_name,
+                    'Email address': customer_email,
+                    'Name': customer_name
+                }),
+                'ConditionExpression': 'attribute_not_exists(PK)'
+            }
+        },
+        {
+            'Put': {
+                'TableName': TABLE_NAME,
+                'Item': serialize_item({
+                    'PK': 'CUSTOMEREMAIL#{}'.format(customer_email),
+                    'SK': 'CUSTOMEREMAIL#{}'.format(customer_email),
+                }),
+                'ConditionExpression': 'attribute_not_exists(PK)'
+            }
+        }
+    ]
+
+
+def _onboard_chunk(customers):
+    report = {'created': 0, 'conflicts': [], 'failed': []}
+    attempt = 0
+
+    while customers:
+        transact_items = []
+        for customer_name, customer_email in customers:
+            transact_items.extend(customer_transact_items(
+                customer_name, customer_email))
+        try:
+            dynamodb.transact_write_items(TransactItems=transact_items)
+            report['created'] += len(customers)
+            return report
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                report['failed'].extend({'username': name, 'email': email, 'reason': str(e)}
+                                        for name, email in customers)
+                return report
+            reasons = e.response.get('CancellationReasons', [])
+
+        # reasons[2 * i] is customer i's username, reasons[2 * i + 1] is their email
+        colliding = set()
+        for index, reason in enumerate(reasons):
+            if reason.get('Code') == 'ConditionalCheckFailed':
+                name, email = customers[index // 2]
+                colliding.add(index // 2)
+                report['conflicts'].append({
+                    'username': name,
+                    'email': email,
+                    'reason': 'username taken' if index % 2 == 0 else 'email taken'
+                })
+
+        if colliding:
+            customers = [customer for index, customer in enumerate(customers)
+                         if index not in colliding]
+            continue
+
+        # cancelled for something else (throttling, a conflicting transaction), back off and send the whole chunk again
+        attempt += 1
+        if attempt > MAX_TRANSACTION_RETRIES:
+            report['failed'].extend({'username': name, 'email': email, 'reason': str(reasons)}
+                                    for name, email in customers)
+            return report
+        batch.backoff(attempt)
+
+    return report
+
+
+def bulk_add_customers(customers, max_workers=8):
+    '''customers is a list of (username, email) tuples.'''
+    report = {'created': 0, 'conflicts': [], 'failed': []}
+
+    # a transaction can't touch the same item twice, so repeats inside the import are conflicts before we send anything
+    unique = []
+    seen_names = set()
+    seen_emails = set()
+    for customer_name, customer_email in customers:
+        if customer_name in seen_names or customer_email in seen_emails:
+            report['conflicts'].append({
+                'username': customer_name,
+                'email': customer_email,
+                'reason': 'duplicate in import'
+            })
+            continue
+        seen_names.add(customer_name)
+        seen_emails.add(customer_email)
+        unique.append((customer_name, customer_email))
+
+    chunks = [unique[start:start + CUSTOMERS_PER_TRANSACTION]
+              for start in range(0, len(unique), CUSTOMERS_PER_TRANSACTION)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk_report in executor.map(_onboard_chunk, chunks):
+            report['created'] += chunk_report['created']
+            report['conflicts'].extend(chunk_report['conflicts'])
+            report['failed'].extend(chunk_report['failed'])
+
+    return report
+
+
+# report = bulk_add_customers([('Customer_{}'.format(i), 'customer_{}@example.com'.format(i)) for i in range(1000)])
+# print(report['created'], report['conflicts'], report['failed'])
@@ -1,12 +1,29 @@
 
 import datetime
-import boto3
 from botocore.exceptions import ClientError
 from botocore.exceptions import ValidationError
 import uuid
 import json
-
-dynamodb = boto3.client('dynamodb', 'us-east-1')
+import random
+import time
+import contextlib
+import io
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from collections import namedtuple
+import os
+import sys
+
+# run from anywhere, the shared helpers live in the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamo_utils import batch  # noqa: E402
+from dynamo_utils.client import lazy_client  # noqa: E402
+from dynamo_utils.codec import deserialize_item, serialize_item  # noqa: E402
+from dynamo_utils.models import from_items  # noqa: E402
+from dynamo_utils.query import iter_query, query_all  # noqa: E402
+
+dynamodb = lazy_client()
 TABLE_NAME = 'chapter_21_github'
 
 
@@ -48,11 +65,14 @@ def add_issues_to_repo(customer_id, repo_name, issue_number, status):
                 "RepoOwner": {"S": customer_id},
                 "Created_At": {"S": created_at.isoformat()},
                 "IssueNumber": {"N": str(issue_number)},
-                "Status": {"S": status}
+                "Status": {"S": status},
+                "GSI4PK": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)},
+                "GSI4SK": {"S": 'ISSUE#{}#{}'.format(status.upper(), str(issue_number).zfill(9))}
             }
         )
         # prints results from a succesful add
         print(result)
+        return result
     except ClientError as e:
         print(e)
 
@@ -64,21 +84,28 @@ def add_issues_to_repo(customer_id, repo_name, issue_number, status):
 '''Now we will make a function that will let us query our data. You can get data about the repo, and its most recent issues
 Since the numbers are zero padded the most recent will always be closes to the SK that is your repo name. You can use that a 
 pivot point. Scan index forward false means you go UP from the pivot point. Limit 11 means you get the piviot and the most recent 10
-items above it (which is our issues).'''
+items above it (which is our issues).
+The stars (STAR#) sort after the repo item, so the key condition has to start at the pivot, otherwise a repo with 10 stars returns only
+stars. It also stops at ISSUE# so the #COUNT# counter shards aren't returned for a repo with fewer than 10 issues.'''
 
 
 def get_repo_and_issues(customer_id, repo_name):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
-            KeyConditionExpression="#pk = :pk",
+            KeyConditionExpression="#pk = :pk AND #sk BETWEEN :issues AND :sk",
             ExpressionAttributeNames={
-                "#pk": "PK", },
+                "#pk": "PK",
+                "#sk": "SK"
+            },
             ExpressionAttributeValues={
                 ":pk": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)},
+                ":issues": {"S": 'ISSUE#'},
+                ":sk": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)}
             },
             ScanIndexForward=False,
-            Limit=11)
+            max_items=11)
         # prints results from a succesful query
         print(result)
         return result
@@ -92,16 +119,11 @@ def get_repo_and_issues(customer_id, repo_name):
 
 
 def print_pretty_results(result):
-    repo_owner = result['Items'][0]['RepoOwner']['S']
-    repo_created = result['Items'][0]['Created_At']['S']
-    repo_name = result['Items'][0]['RepoName']['S']
-
-    issue_number = result['Items'][1]['IssueNumber']['N']
-    issue_created = result['Items'][1]['Created_At']['S']
-    issue_status = result['Items'][1]['Status']['S']
+    repo = deserialize_item(result['Items'][0])
+    issue = deserialize_item(result['Items'][1])
 
     print('\nThe repo owner is {}\nit was created at {}\nthe name of repo is {}.\nThe most recent issue was created at {}.\nThe issue status is {}\nThe total number of issues is {}'.format(
-        repo_owner, repo_created, repo_name, issue_created, issue_status, issue_number))
+        repo['RepoOwner'], repo['Created_At'], repo['RepoName'], issue['Created_At'], issue['Status'], issue['IssueNumber']))
 
 
 # print_pretty_results(get_repo_and_issues(
@@ -119,8 +141,15 @@ def update_issue_status(customer_id, repo_name, issue_number, status):
                 'PK': {'S': 'REPO#{}#{}'.format(customer_id, repo_name)},
                 'SK': {'S': 'ISSUE#{}'.format(str(issue_number).zfill(9))}
             },
-            AttributeUpdates={
-                'Status': {'Value': {'S': 'Closed'}}
+            UpdateExpression="SET #status = :status, GSI4PK = :gsi4pk, GSI4SK = :gsi4sk",
+            ConditionExpression="attribute_exists(PK)",
+            ExpressionAttributeNames={
+                "#status": "Status"
+            },
+            ExpressionAttributeValues={
+                ":status": {"S": status},
+                ":gsi4pk": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)},
+                ":gsi4sk": {"S": 'ISSUE#{}#{}'.format(status.upper(), str(issue_number).zfill(9))}
             }
         )
         # prints results from a succesful add
@@ -175,6 +204,7 @@ def put_pull_request(customer_id, repo_name, pull_request_number):
         )
         # prints results from a succesful add
         print(result)
+        return result
     except ClientError as e:
         print(e)
 
@@ -197,7 +227,8 @@ we can do a query to join the info'''
 
 
 def query_repo_and_pull_request(customer_id, repo_name):
-    results = dynamodb.query(
+    results = query_all(
+        dynamodb,
         TableName=TABLE_NAME,
         IndexName='GSI1-index',
         ExpressionAttributeValues={
@@ -208,6 +239,7 @@ def query_repo_and_pull_request(customer_id, repo_name):
     )
 
     print(results)
+    return results
 
 
 ''' When you look at the dynamo table, you will see that the values returned by this query are all seperate items in the table
@@ -254,7 +286,9 @@ def add_issues_to_repo_with_increment(customer_id, repo_name, status):
                 "RepoOwner": {"S": customer_id},
                 "Created_At": {"S": created_at.isoformat()},
                 "IssueNumber": {"N": str(current_count)},
-                "Status": {"S": status}
+                "Status": {"S": status},
+                "GSI4PK": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)},
+                "GSI4SK": {"S": 'ISSUE#{}#{}'.format(status.upper(), str(current_count).zfill(9))}
             }
         )
         # prints results from a succesful add
@@ -307,21 +341,114 @@ def put_pull_request_with_increment(customer_id, repo_name):
 # put_pull_request_with_increment('jonathanbradbury', 'example_repo')
 
 
+''' the increment functions above need two round trips for every issue or pull request (update the counter, then put the item) and every single one
+goes through the repo item. A NumberAllocator reserves a whole block of numbers with one ADD on the counter and then hands them out from memory,
+so most issues are just the one put, and the repo item sees one write per NUMBER_BLOCK_SIZE issues.
+Numbers stay unique across processes because each block comes from the atomic ADD. The catch: a process that stops takes the rest of its block
+with it, so you can get gaps in the numbering. Issues and pull requests still share the same sequence.'''
+
+NUMBER_BLOCK_SIZE = 50
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+class NumberAllocator:
+
+    def __init__(self, customer_id, repo_name, block_size=NUMBER_BLOCK_SIZE):
+        self.customer_id = customer_id
+        self.repo_name = repo_name
+        self.block_size = block_size
+        self._next = 1
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def _reserve_block(self):
+        resp = dynamodb.update_item(
+            TableName=TABLE_NAME,
+            Key={
+                'PK': {'S': 'REPO#{}#{}'.format(self.customer_id, self.repo_name)},
+                'SK': {'S': 'REPO#{}#{}'.format(self.customer_id, self.repo_name)}
+            },
+            UpdateExpression="ADD #count :block",
+            ConditionExpression="attribute_exists(PK)",
+            ExpressionAttributeNames={
+                "#count": "IssuesAndPullRequestCount",
+            },
+            ExpressionAttributeValues={
+                ":block": {"N": str(self.block_size)}
+            },
+            ReturnValues='UPDATED_NEW'
+        )
+        # we own everything from the old count + 1 up to the new count
+        self._last = int(resp['Attributes']['IssuesAndPullRequestCount']['N'])
+        self._next = self._last - self.block_size + 1
+
+    def next_number(self):
+        with self._lock:
+            if self._next > self._last:
+                self._reserve_block()
+            number = self._next
+            self._next += 1
+            return number
+
+
+def get_number_allocator(customer_id, repo_name):
+    with _allocators_lock:
+        key = (customer_id, repo_name)
+        if key not in _allocators:
+            _allocators[key] = NumberAllocator(customer_id, repo_name)
+        return _allocators[key]
+
+
+def add_issues_to_repo_with_allocator(customer_id, repo_name, status):
+    try:
+        issue_number = get_number_allocator(
+            customer_id, repo_name).next_number()
+    except ClientError as e:
+        print(e)
+        return None
+    if add_issues_to_repo(customer_id, repo_name, issue_number, status) is None:
+        # the number is used up either way, but there is no issue with it
+        return None
+    return issue_number
+
+
+def put_pull_request_with_allocator(customer_id, repo_name):
+    try:
+        pull_request_number = get_number_allocator(
+            customer_id, repo_name).next_number()
+    except ClientError as e:
+        print(e)
+        return None
+    if put_pull_request(customer_id, repo_name, pull_request_number) is None:
+        return None
+    return pull_request_number
+
+
+# add_issues_to_repo_with_allocator('jonathanbradbury', 'example_repo', 'Open')
+# put_pull_request_with_allocator('jonathanbradbury', 'example_repo')
+
+
 ''' now lets get our issue items by open or closed status'''
 
 
 def get_issues_with_filter(customer_id, repo_name, status_filter):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
-            KeyConditionExpression="#pk = :pk",
+            # starting at ISSUE# skips the #COUNT# counter shards, they have no Status either and would pass the filter
+            KeyConditionExpression="#pk = :pk AND #sk >= :sk",
             FilterExpression="attribute_not_exists(#status) OR #status = :status",
             ExpressionAttributeNames={
                 "#pk": "PK",
+                "#sk": "SK",
                 "#status": "Status"
             },
             ExpressionAttributeValues={
                 ":pk": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)},
+                ":sk": {"S": 'ISSUE#'},
                 ":status": {"S": status_filter}
             },
             ScanIndexForward=False
@@ -337,6 +464,120 @@ def get_issues_with_filter(customer_id, repo_name, status_filter):
 # get_issues_with_filter('jonathanbradbury', 'example_repo', 'Closed')
 
 
+''' get_issues_with_filter reads the whole item collection (the repo, every issue, every star) and throws away what doesn't match AFTER you've paid
+for reading it. Compare ScannedCount with Count in its response. Instead every issue now also gets GSI4PK = REPO#<owner>#<repo> and
+GSI4SK = ISSUE#<STATUS>#<number>, and update_issue_status moves it when the status changes. Only issues have those attributes so GSI4-index is a
+sparse index with nothing but issues in it, sorted by status and then number, and begins_with on the status reads exactly the matching issues.
+Add GSI4-index (GSI4PK hash, GSI4SK range, projection ALL) to the table first, then run backfill_issue_status_index for issues made before this.'''
+
+
+def get_issues_by_status(customer_id, repo_name, status, newest_first=True):
+    query_args = {
+        'TableName': TABLE_NAME,
+        'IndexName': 'GSI4-index',
+        'KeyConditionExpression': 'GSI4PK = :GSI4PK AND begins_with(GSI4SK, :status)',
+        'ExpressionAttributeValues': {
+            ':GSI4PK': {'S': 'REPO#{}#{}'.format(customer_id, repo_name)},
+            ':status': {'S': 'ISSUE#{}#'.format(status.upper())}
+        },
+        'ScanIndexForward': not newest_first
+    }
+
+    try:
+        result = query_all(dynamodb, **query_args)
+    except ClientError as e:
+        print(e)
+        return None
+
+    print(result)
+    return result
+
+
+def backfill_issue_status_index(customer_id, repo_name):
+    query_args = {
+        'TableName': TABLE_NAME,
+        'KeyConditionExpression': '#pk = :pk AND begins_with(#sk, :sk)',
+        'FilterExpression': 'attribute_not_exists(GSI4PK)',
+        'ExpressionAttributeNames': {
+            '#pk': 'PK',
+            '#sk': 'SK'
+        },
+        'ExpressionAttributeValues': {
+            ':pk': {'S': 'REPO#{}#{}'.format(customer_id, repo_name)},
+            ':sk': {'S': 'ISSUE#'}
+        }
+    }
+    fixed = 0
+
+    for item in iter_query(dynamodb, **query_args):
+        update_issue_status(customer_id, repo_name, item['IssueNumber']['N'], item['Status']['S'])
+        fixed += 1
+    return fixed
+
+
+def seed_issues(customer_id, repo_name, count=100000, open_ratio=0.1):
+    '''Writes count issues straight into a repo with BatchWriteItem, about open_ratio of them Open and the rest Closed.'''
+    created_at = datetime.datetime.now().isoformat()
+    requests = []
+    for issue_number in range(1, count + 1):
+        status = 'Open' if random.random() < open_ratio else 'Closed'
+        requests.append({'PutRequest': {'Item': serialize_item({
+            'PK': 'REPO#{}#{}'.format(customer_id, repo_name),
+            'SK': 'ISSUE#{}'.format(str(issue_number).zfill(9)),
+            "RepoName": repo_name,
+            "RepoOwner": customer_id,
+            "Created_At": created_at,
+            "IssueNumber": issue_number,
+            "Status": status,
+            "GSI4PK": 'REPO#{}#{}'.format(customer_id, repo_name),
+            "GSI4SK": 'ISSUE#{}#{}'.format(status.upper(), str(issue_number).zfill(9))
+        })}})
+
+    batch.batch_write_requests(dynamodb, requests, TABLE_NAME)
+
+
+def _read_all_pages(**query_args):
+    result = query_all(dynamodb, ReturnConsumedCapacity='TOTAL', **query_args)
+    return {'Count': result['Count'], 'ScannedCount': result['ScannedCount'], 'RCU': result['ConsumedCapacity']['CapacityUnits']}
+
+
+def benchmark_issue_listing(customer_id, repo_name, status='Open', seed=0):
+    '''Lists every issue with the given status both ways and reports Count, ScannedCount and RCU for each.
+    Pass seed=100000 to fill the repo with that many issues first.'''
+    if seed:
+        seed_issues(customer_id, repo_name, seed)
+
+    report = {
+        'filter_expression': _read_all_pages(
+            TableName=TABLE_NAME,
+            KeyConditionExpression="#pk = :pk",
+            FilterExpression="attribute_not_exists(#status) OR #status = :status",
+            ExpressionAttributeNames={
+                "#pk": "PK",
+                "#status": "Status"
+            },
+            ExpressionAttributeValues={
+                ":pk": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)},
+                ":status": {"S": status}
+            }),
+        'status_index': _read_all_pages(
+            TableName=TABLE_NAME,
+            IndexName='GSI4-index',
+            KeyConditionExpression='GSI4PK = :GSI4PK AND begins_with(GSI4SK, :status)',
+            ExpressionAttributeValues={
+                ':GSI4PK': {'S': 'REPO#{}#{}'.format(customer_id, repo_name)},
+                ':status': {'S': 'ISSUE#{}#'.format(status.upper())}
+            })
+    }
+    print(report)
+    return report
+
+
+# get_issues_by_status('jonathanbradbury', 'example_repo', 'Closed')
+# backfill_issue_status_index('jonathanbradbury', 'example_repo')
+# benchmark_issue_listing('jonathanbradbury', 'issue_benchmark', 'Open', seed=100000)
+
+
 ''' Okay so now we're adding forks, which means we need to haave another GSI'''
 
 
@@ -406,7 +647,8 @@ def put_fork_with_GSI_GSI2_increment(customer_id, repo_owner, repo_name):
 
 
 def query_repo_and_forks(customer_id, repo_name):
-    results = dynamodb.query(
+    results = query_all(
+        dynamodb,
         TableName=TABLE_NAME,
         IndexName='GSI2-index',
         ExpressionAttributeValues={
@@ -417,6 +659,7 @@ def query_repo_and_forks(customer_id, repo_name):
     )
 
     print(results)
+    return results
 
 
 # query_repo_and_forks('jonathanbradbury', 'another_example')
@@ -425,18 +668,20 @@ def query_repo_and_forks(customer_id, repo_name):
 ''' okay now lets give users the ability to star a repo'''
 
 
-def add_stars_to_repo(customer_id, repo_name, starring_user):
+def add_stars_to_repo(customer_id, repo_name, starring_user, buffer=None):
+    item = {
+        'PK': {'S': 'REPO#{}#{}'.format(customer_id, repo_name)},
+        'SK': {'S': 'STAR#{}'.format(starring_user)},
+        "RepoName": {"S": repo_name},
+        "RepoOwner": {"S": customer_id},
+        "StarringUser": {"S": str(starring_user)}
+    }
+    if buffer is not None:
+        # queued to go out in a batch, wait on the future it returns if you need to know it was written
+        return buffer.put(TABLE_NAME, item)
+
     try:
-        result = dynamodb.put_item(
-            TableName=TABLE_NAME,
-            Item={
-                'PK': {'S': 'REPO#{}#{}'.format(customer_id, repo_name)},
-                'SK': {'S': 'STAR#{}'.format(starring_user)},
-                "RepoName": {"S": repo_name},
-                "RepoOwner": {"S": customer_id},
-                "StarringUser": {"S": str(starring_user)}
-            }
-        )
+        result = dynamodb.put_item(TableName=TABLE_NAME, Item=item)
         # prints results from a succesful add
         print(result)
     except ClientError as e:
@@ -445,6 +690,12 @@ def add_stars_to_repo(customer_id, repo_name, starring_user):
 
 # add_stars_to_repo('jonathanbradbury', 'another_example', 'Robbie Kohler')
 
+''' to star a lot at once hand it a WriteBehindBuffer, the puts are queued and sent 25 at a time in the background'''
+# from dynamo_utils.writer import WriteBehindBuffer
+# with WriteBehindBuffer(dynamodb) as buffer:
+#     for user in ('Hermes', 'Zoidberg', 'Amy Wong'):
+#         add_stars_to_repo('jonathanbradbury', 'another_example', user, buffer=buffer)
+
 
 ''' Okay now lets query stars for a repo 
 Notice "#pk = :pk AND #sk >= :sk" This is where the alphabetical ordering of dynamo comes into play. We always have
@@ -455,8 +706,10 @@ our issues ABOVE the SK and our stars BELOW. So you can use sk >=SK to get all t
 '''Note the queries below are returning items from the same collection'''
 
 
-def query_stars_no_issues(repo_owner, repo_name):
-    result = dynamodb.query(
+def query_stars_no_issues(repo_owner, repo_name, max_items=None):
+    result = query_all(
+        dynamodb,
+        max_items=max_items,
         TableName=TABLE_NAME,
         KeyConditionExpression="#pk = :pk AND #sk >= :sk",
         ExpressionAttributeNames={
@@ -471,30 +724,183 @@ def query_stars_no_issues(repo_owner, repo_name):
     )
 
     print(result)
+    return result
 
 
 def query_issues_no_stars(repo_owner, repo_name):
-    result = dynamodb.query(
+    result = query_all(
+        dynamodb,
         TableName=TABLE_NAME,
-        KeyConditionExpression="#pk = :pk AND #sk <= :sk",
+        # from ISSUE# rather than the start of the collection, so the #COUNT# counter shards below the issues are left out
+        KeyConditionExpression="#pk = :pk AND #sk BETWEEN :issues AND :sk",
         ExpressionAttributeNames={
             "#pk": "PK",
             "#sk": "SK"
         },
         ExpressionAttributeValues={
             ":pk": {"S": 'REPO#{}#{}'.format(repo_owner, repo_name)},
+            ":issues": {"S": 'ISSUE#'},
             ":sk": {"S": 'REPO#{}#{}'.format(repo_owner, repo_name)}
         },
         ScanIndexForward=True
     )
 
     print(result)
+    return result
 
 
 # query_stars_no_issues('jonathanbradbury', 'another_example')
 # query_issues_no_stars('jonathanbradbury', 'another_example')
 
 
+''' Both queries above now read every page, so a popular repo's stars are no longer cut off at 1 MB, but they're all loaded into one list.
+iter_stargazers streams them instead: it hands back one star at a time and fetches the next page in the background while you work on
+the current one. Pass max_items or max_rcu to stop early.'''
+
+
+def iter_stargazers(repo_owner, repo_name, max_items=None, max_rcu=None):
+    return iter_query(
+        dynamodb,
+        max_items=max_items,
+        max_rcu=max_rcu,
+        TableName=TABLE_NAME,
+        KeyConditionExpression="#pk = :pk AND begins_with(#sk, :sk)",
+        ExpressionAttributeNames={
+            "#pk": "PK",
+            "#sk": "SK"
+        },
+        ExpressionAttributeValues={
+            ":pk": {"S": 'REPO#{}#{}'.format(repo_owner, repo_name)},
+            ":sk": {"S": 'STAR#'}
+        }
+    )
+
+
+# for star in iter_stargazers('jonathanbradbury', 'another_example'):
+#     print(star['StarringUser']['S'])
+
+
+''' A repo landing page needs all four of the reads above: the repo and its newest issues, the pull requests (GSI1), the forks (GSI2) and the stars.
+None of them depend on each other, so instead of paying for four round trips one after another we send them at the same time and the page
+takes as long as the slowest one. Every section gets its own timeout, measured from when a worker actually starts it, so a busy pool makes a page
+slower instead of making dynamo look slow. A section that is too slow or errors is left empty and listed in errors so the page can still render
+the rest. A section that already started can't be stopped, it finishes in the background and keeps its worker until then, which is why the
+pool has room for OVERVIEW_CONCURRENCY pages at once. One that is still waiting for a worker after OVERVIEW_QUEUE_TIMEOUT is given up on.'''
+
+OVERVIEW_TIMEOUT = 2.0
+OVERVIEW_QUEUE_TIMEOUT = 5.0
+# the landing page only shows the first stars, a popular repo has far too many to read them all
+OVERVIEW_STAR_LIMIT = 100
+# how many overviews you expect to be building at the same time, each one keeps up to four workers busy
+OVERVIEW_CONCURRENCY = 32
+
+RepoOverview = namedtuple(
+    'RepoOverview', ['repo', 'issues', 'pull_requests', 'forks', 'stars', 'errors', 'elapsed_seconds'])
+
+# shared so a section that timed out doesn't hold up the caller while it finishes in the background
+_overview_executor = ThreadPoolExecutor(max_workers=OVERVIEW_CONCURRENCY * 4)
+
+
+def _stargazers_page(repo_owner, repo_name, limit):
+    return {'Items': list(iter_stargazers(repo_owner, repo_name, max_items=limit))}
+
+
+def _run_section(started_at, function, *args):
+    # the caller's timeout for this section runs from here, not from when it was queued
+    started_at.set_result(time.perf_counter())
+    return function(*args)
+
+
+def get_repo_overview(repo_owner, repo_name, timeouts=None):
+    '''timeouts maps a section name (repo, pull_requests, forks, stars) to seconds, anything missing uses OVERVIEW_TIMEOUT.'''
+    timeouts = timeouts or {}
+    started = time.perf_counter()
+    sections = {
+        'repo': (get_repo_and_issues, repo_owner, repo_name),
+        'pull_requests': (query_repo_and_pull_request, repo_owner, repo_name),
+        'forks': (query_repo_and_forks, repo_owner, repo_name),
+        'stars': (_stargazers_page, repo_owner, repo_name, OVERVIEW_STAR_LIMIT)
+    }
+    futures = {}
+    for section, call in sections.items():
+        started_at = Future()
+        futures[section] = (started_at, _overview_executor.submit(_run_section, started_at, *call))
+
+    items = {}
+    errors = {}
+    for section, (started_at, future) in futures.items():
+        try:
+            section_started = started_at.result(timeout=max(started + OVERVIEW_QUEUE_TIMEOUT - time.perf_counter(), 0))
+        except FutureTimeoutError:
+            future.cancel()
+            errors[section] = 'never started, the overview pool is full'
+            items[section] = []
+            continue
+
+        remaining = section_started + timeouts.get(section, OVERVIEW_TIMEOUT) - time.perf_counter()
+        try:
+            result = future.result(timeout=max(remaining, 0))
+        except FutureTimeoutError:
+            errors[section] = 'timed out'
+            result = None
+        except Exception as e:
+            # ClientError, a ValidationError, a BotoCoreError from the connection ... any of them only costs this section
+            errors[section] = '{}: {}'.format(type(e).__name__, e)
+            result = None
+        if result is None and section not in errors:
+            # get_repo_and_issues prints the ClientError and returns None
+            errors[section] = 'query failed'
+        items[section] = result['Items'] if result else []
+
+    repo_key = 'REPO#{}#{}'.format(repo_owner, repo_name)
+    repo = next((item for item in items['repo'] if item['SK']['S'] == repo_key), None)
+    if repo is None:
+        # the repo item is in GSI1 as well, so we can still show it if only the main table query failed
+        repo = next((item for item in items['pull_requests']
+                     if item['GSI1SK']['S'] == repo_key), None)
+
+    overview = RepoOverview(
+        repo=repo,
+        issues=[item for item in items['repo'] if item['SK']['S'].startswith('ISSUE#')],
+        pull_requests=[item for item in items['pull_requests']
+                       if item['GSI1SK']['S'].startswith('PR#')],
+        forks=[item for item in items['forks'] if item['GSI2SK']['S'].startswith('FORK#')],
+        stars=items['stars'],
+        errors=errors,
+        elapsed_seconds=time.perf_counter() - started
+    )
+    print(overview)
+    return overview
+
+
+# get_repo_overview('jonathanbradbury', 'another_example')
+# get_repo_overview('jonathanbradbury', 'another_example', timeouts={'stars': 0.5})
+
+
+''' Exporting a whole repo collection (the repo, every issue and every star) as raw items means holding a nested dict per attribute for every
+item. export_repo_collection streams the collection and keeps each item as one of the entity classes from dynamo_utils.models instead, which
+only hold the attribute payloads and decode them when you read them. The #COUNT# counter shards aren't entities and are left out.'''
+
+
+def export_repo_collection(repo_owner, repo_name):
+    return from_items(iter_query(
+        dynamodb,
+        TableName=TABLE_NAME,
+        KeyConditionExpression="#pk = :pk",
+        ExpressionAttributeNames={
+            "#pk": "PK"
+        },
+        ExpressionAttributeValues={
+            ":pk": {"S": 'REPO#{}#{}'.format(repo_owner, repo_name)}
+        }
+    ))
+
+
+# from dynamo_utils.models import Issue
+# issues = [entity for entity in export_repo_collection('jonathanbradbury', 'dynamodb_examples') if isinstance(entity, Issue)]
+# print(sum(1 for issue in issues if issue.status == 'Open'))
+
+
 ''' the above examples for adding forks and stars are great, but we also want to count 
 the number of forks and stars. We will do the same thing we did for the issue and pull request
 tracker'''
@@ -606,6 +1012,174 @@ def add_forks_to_repo_with_increment(repo_owner, repo_name, forking_user):
 #     'jonathanbradbury', 'another_example', 'RobbieKohler')
 
 
+''' every star and fork above also updates the one REPO# item, so a trending repo turns that single item into a hot key and dynamo starts throttling
+it at the per item write limit. The sharded versions below spread the count over several counter items in the repo's item collection
+(SK #COUNT#StarCount#000, #COUNT#StarCount#001 ...) and pick one at random for each increment, ADD creates the shard the first time it's used.
+Reading the count means adding the shards up (plus whatever was already counted on the repo item). Writers can each pick their own number of
+shards, so get_sharded_count doesn't guess which shards exist: it queries every #COUNT#<attribute># item in the collection, reads the repo item,
+and keeps the total for COUNTER_CACHE_SECONDS. More shards means more write throughput but a bigger read, 10 is a good place to start.
+The counter items sort above the issues, so the issue queries start their sort key condition at ISSUE# to leave them out.'''
+
+COUNTER_SHARDS = 10
+COUNTER_CACHE_SECONDS = 5
+
+_counter_cache = {}
+
+
+def counter_shard_key(repo_owner, repo_name, attribute, shard):
+    return {
+        'PK': {'S': 'REPO#{}#{}'.format(repo_owner, repo_name)},
+        'SK': {'S': '#COUNT#{}#{}'.format(attribute, str(shard).zfill(3))}
+    }
+
+
+def _sharded_increment(shard_key, attribute):
+    return {
+        "Update": {
+            "Key": shard_key,
+            "TableName": TABLE_NAME,
+            "UpdateExpression": "ADD #count :incr",
+            "ExpressionAttributeNames": {
+                "#count": attribute
+            },
+            "ExpressionAttributeValues": {
+                ":incr": {"N": "1"}
+            }
+        }
+    }
+
+
+def add_stars_to_repo_with_sharded_increment(repo_owner, repo_name, starring_user, shards=COUNTER_SHARDS):
+    shard = random.randrange(shards)
+    try:
+        result = dynamodb.transact_write_items(
+            TransactItems=[
+                {
+                    "Put": {
+                        "Item": {
+                            'PK': {'S': 'REPO#{}#{}'.format(repo_owner, repo_name)},
+                            'SK': {'S': 'STAR#{}'.format(starring_user)},
+                            "RepoName": {"S": repo_name},
+                            "RepoOwner": {"S": repo_owner},
+                            "StarringUser": {"S": starring_user}
+                        },
+                        "TableName": TABLE_NAME,
+                        "ConditionExpression": "attribute_not_exists(SK)"
+                    }
+                },
+                _sharded_increment(counter_shard_key(
+                    repo_owner, repo_name, 'StarCount', shard), 'StarCount')
+            ]
+        )
+        print(result)
+        return result
+    except ClientError as e:
+        print(e)
+
+
+def add_forks_to_repo_with_sharded_increment(repo_owner, repo_name, forking_user, shards=COUNTER_SHARDS):
+    shard = random.randrange(shards)
+    try:
+        created_at = datetime.datetime.now()
+        result = dynamodb.transact_write_items(
+            TransactItems=[
+                {
+                    "Put": {
+                        "Item": {
+                            'PK': {'S': 'REPO#{}#{}'.format(forking_user, repo_name)},
+                            'SK': {'S': 'REPO#{}#{}'.format(forking_user, repo_name)},
+                            "RepoName": {"S": repo_name},
+                            "RepoOwner": {"S": forking_user},
+                            "Created_At": {"S": created_at.isoformat()},
+                            "GSI1PK": {"S": 'REPO#{}#{}'.format(forking_user, repo_name)},
+                            "GSI1SK": {"S": 'REPO#{}#{}'.format(forking_user, repo_name)},
+                            "GSI2PK": {"S": 'REPO#{}#{}'.format(repo_owner, repo_name)},
+                            "GSI2SK": {"S": 'FORK#{}'.format(forking_user)},
+                            "IssuesAndPullRequestCount": {"N": '0'},
+                            "StarCount": {"N": '0'},
+                            "ForkCount": {"N": '0'}
+                        },
+                        "TableName": TABLE_NAME,
+                        "ConditionExpression": "attribute_not_exists(PK)"
+                    }
+                },
+                _sharded_increment(counter_shard_key(
+                    repo_owner, repo_name, 'ForkCount', shard), 'ForkCount')
+            ]
+        )
+        print(result)
+        return result
+    except ClientError as e:
+        print(e)
+
+
+def get_sharded_count(repo_owner, repo_name, attribute):
+    cache_key = (repo_owner, repo_name, attribute)
+    cached = _counter_cache.get(cache_key)
+    if cached is not None and cached[0] > time.time():
+        return cached[1]
+
+    repo_key = 'REPO#{}#{}'.format(repo_owner, repo_name)
+    shards = query_all(
+        dynamodb,
+        TableName=TABLE_NAME,
+        KeyConditionExpression="#pk = :pk AND begins_with(#sk, :sk)",
+        ProjectionExpression='#count',
+        ExpressionAttributeNames={
+            "#pk": "PK",
+            "#sk": "SK",
+            "#count": attribute
+        },
+        ExpressionAttributeValues={
+            ":pk": {"S": repo_key},
+            ":sk": {"S": '#COUNT#{}#'.format(attribute)}
+        }
+    )
+    # the repo item is read too so counts from before sharding was turned on still add up
+    repo = dynamodb.get_item(
+        TableName=TABLE_NAME,
+        Key={'PK': {'S': repo_key}, 'SK': {'S': repo_key}},
+        ProjectionExpression='#count',
+        ExpressionAttributeNames={'#count': attribute}
+    ).get('Item', {})
+
+    total = sum(int(item.get(attribute, {}).get('N', 0)) for item in shards['Items'] + [repo])
+    _counter_cache[cache_key] = (time.time() + COUNTER_CACHE_SECONDS, total)
+    return total
+
+
+def load_test_star_counter(repo_owner, repo_name, shard_counts=(1, 2, 4, 8, 16), stars_per_run=2000, threads=32):
+    '''Hammers one repo with stars from lots of threads once per shard count and reports stars per second and how many were throttled.
+    Each run uses new starring users so they don't collide with the run before.'''
+    report = []
+    for shards in shard_counts:
+        run_id = uuid.uuid4().hex[:8]
+
+        def star(number):
+            return add_stars_to_repo_with_sharded_increment(
+                repo_owner, repo_name, 'load_{}_{}'.format(run_id, number), shards)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                results = list(executor.map(star, range(stars_per_run)))
+            elapsed = time.perf_counter() - started
+
+        succeeded = sum(1 for result in results if result is not None)
+        report.append({
+            'shards': shards,
+            'stars_per_second': succeeded / elapsed,
+            'throttled_or_failed': stars_per_run - succeeded
+        })
+    print(report)
+    return report
+
+
+# add_stars_to_repo_with_sharded_increment('jonathanbradbury', 'another_example', 'Hermes')
+# get_sharded_count('jonathanbradbury', 'another_example', 'StarCount')
+# load_test_star_counter('jonathanbradbury', 'another_example')
+
+
 ''' i'm leaving out messages and reactions (for now ) since they're not tied to any data, you just query them out, thats a simple mode we have seen a dozen times already'''
 
 
@@ -654,19 +1228,21 @@ def put_org(org, payment_plan):
         print(e)
 
 
-def put_membership(org, member):
+def put_membership(org, member, buffer=None):
     created_at = datetime.datetime.now()
+    item = {
+        'PK': {'S': 'ACCOUNT#{}'.format(org)},
+        'SK': {'S': 'MEMBERSHIP#{}'.format(member)},
+        "Role": {"S": 'Member'},
+        "UserName": {"S": member},
+        "CreatedAt": {"S": created_at.isoformat()},
+    }
+    if buffer is not None:
+        # queued to go out in a batch, wait on the future it returns if you need to know it was written
+        return buffer.put(TABLE_NAME, item)
+
     try:
-        result = dynamodb.put_item(
-            TableName=TABLE_NAME,
-            Item={
-                'PK': {'S': 'ACCOUNT#{}'.format(org)},
-                'SK': {'S': 'MEMBERSHIP#{}'.format(member)},
-                "Role": {"S": 'Member'},
-                "UserName": {"S": member},
-                "CreatedAt": {"S": created_at.isoformat()},
-            }
-        )
+        result = dynamodb.put_item(TableName=TABLE_NAME, Item=item)
         print(result)
     except ClientError as e:
         print(e)
@@ -717,7 +1293,8 @@ we will add an org and make this user a member of that org'''
 
 
 def query_user_info(account_name):
-    results = dynamodb.query(
+    results = query_all(
+        dynamodb,
         TableName=TABLE_NAME,
         IndexName='GSI3-index',
         ExpressionAttributeValues={
@@ -730,4 +1307,4 @@ def query_user_info(account_name):
     print(results)
 
 
-query_user_info('Flexo')
+# query_user_info('Flexo')
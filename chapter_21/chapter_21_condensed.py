@@ -1,27 +1,39 @@
 
 import datetime
-import boto3
 from botocore.exceptions import ClientError
 from botocore.exceptions import ValidationError
 import uuid
 import json
+import os
+import sys
 
-dynamodb = boto3.client('dynamodb', 'us-east-1')
+# run from anywhere, the shared helpers live in the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamo_utils import metrics  # noqa: E402
+from dynamo_utils.client import lazy_client  # noqa: E402
+from dynamo_utils.query import query_all  # noqa: E402
+
+dynamodb = lazy_client()
 TABLE_NAME = 'chapter_21_github'
 
 
 def get_repo_and_issues(customer_id, repo_name):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
-            KeyConditionExpression="#pk = :pk",
+            KeyConditionExpression="#pk = :pk AND #sk BETWEEN :issues AND :sk",
             ExpressionAttributeNames={
-                "#pk": "PK", },
+                "#pk": "PK",
+                "#sk": "SK"
+            },
             ExpressionAttributeValues={
                 ":pk": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)},
+                ":issues": {"S": 'ISSUE#'},
+                ":sk": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)}
             },
             ScanIndexForward=False,
-            Limit=11)
+            max_items=11)
         print(result)
         return result
     except ClientError as e:
@@ -36,8 +48,15 @@ def update_issue_status(customer_id, repo_name, issue_number, status):
                 'PK': {'S': 'REPO#{}#{}'.format(customer_id, repo_name)},
                 'SK': {'S': 'ISSUE#{}'.format(str(issue_number).zfill(9))}
             },
-            AttributeUpdates={
-                'Status': {'Value': {'S': 'Closed'}}
+            UpdateExpression="SET #status = :status, GSI4PK = :gsi4pk, GSI4SK = :gsi4sk",
+            ConditionExpression="attribute_exists(PK)",
+            ExpressionAttributeNames={
+                "#status": "Status"
+            },
+            ExpressionAttributeValues={
+                ":status": {"S": status},
+                ":gsi4pk": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)},
+                ":gsi4sk": {"S": 'ISSUE#{}#{}'.format(status.upper(), str(issue_number).zfill(9))}
             }
         )
         print(result)
@@ -46,7 +65,8 @@ def update_issue_status(customer_id, repo_name, issue_number, status):
 
 
 def query_repo_and_pull_request(customer_id, repo_name):
-    results = dynamodb.query(
+    results = query_all(
+        dynamodb,
         TableName=TABLE_NAME,
         IndexName='GSI1-index',
         ExpressionAttributeValues={
@@ -89,7 +109,9 @@ def add_issues_to_repo_with_increment(customer_id, repo_name, status):
                 "RepoOwner": {"S": customer_id},
                 "Created_At": {"S": created_at.isoformat()},
                 "IssueNumber": {"N": str(current_count)},
-                "Status": {"S": status}
+                "Status": {"S": status},
+                "GSI4PK": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)},
+                "GSI4SK": {"S": 'ISSUE#{}#{}'.format(status.upper(), str(current_count).zfill(9))}
             }
         )
         print(result)
@@ -138,16 +160,19 @@ def put_pull_request_with_increment(customer_id, repo_name):
 
 def get_issues_with_filter(customer_id, repo_name, status_filter):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
-            KeyConditionExpression="#pk = :pk",
+            KeyConditionExpression="#pk = :pk AND #sk >= :sk",
             FilterExpression="attribute_not_exists(#status) OR #status = :status",
             ExpressionAttributeNames={
                 "#pk": "PK",
+                "#sk": "SK",
                 "#status": "Status"
             },
             ExpressionAttributeValues={
                 ":pk": {"S": 'REPO#{}#{}'.format(customer_id, repo_name)},
+                ":sk": {"S": 'ISSUE#'},
                 ":status": {"S": status_filter}
             },
             ScanIndexForward=False
@@ -159,8 +184,31 @@ def get_issues_with_filter(customer_id, repo_name, status_filter):
         print(e)
 
 
+def get_issues_by_status(customer_id, repo_name, status, newest_first=True):
+    query_args = {
+        'TableName': TABLE_NAME,
+        'IndexName': 'GSI4-index',
+        'KeyConditionExpression': 'GSI4PK = :GSI4PK AND begins_with(GSI4SK, :status)',
+        'ExpressionAttributeValues': {
+            ':GSI4PK': {'S': 'REPO#{}#{}'.format(customer_id, repo_name)},
+            ':status': {'S': 'ISSUE#{}#'.format(status.upper())}
+        },
+        'ScanIndexForward': not newest_first
+    }
+
+    try:
+        result = query_all(dynamodb, **query_args)
+    except ClientError as e:
+        print(e)
+        return None
+
+    print(result)
+    return result
+
+
 def query_repo_and_forks(customer_id, repo_name):
-    results = dynamodb.query(
+    results = query_all(
+        dynamodb,
         TableName=TABLE_NAME,
         IndexName='GSI2-index',
         ExpressionAttributeValues={
@@ -174,7 +222,8 @@ def query_repo_and_forks(customer_id, repo_name):
 
 
 def query_stars_no_issues(repo_owner, repo_name):
-    result = dynamodb.query(
+    result = query_all(
+        dynamodb,
         TableName=TABLE_NAME,
         KeyConditionExpression="#pk = :pk AND #sk >= :sk",
         ExpressionAttributeNames={
@@ -192,15 +241,17 @@ def query_stars_no_issues(repo_owner, repo_name):
 
 
 def query_issues_no_stars(repo_owner, repo_name):
-    result = dynamodb.query(
+    result = query_all(
+        dynamodb,
         TableName=TABLE_NAME,
-        KeyConditionExpression="#pk = :pk AND #sk <= :sk",
+        KeyConditionExpression="#pk = :pk AND #sk BETWEEN :issues AND :sk",
         ExpressionAttributeNames={
             "#pk": "PK",
             "#sk": "SK"
         },
         ExpressionAttributeValues={
             ":pk": {"S": 'REPO#{}#{}'.format(repo_owner, repo_name)},
+            ":issues": {"S": 'ISSUE#'},
             ":sk": {"S": 'REPO#{}#{}'.format(repo_owner, repo_name)}
         },
         ScanIndexForward=True
@@ -342,19 +393,21 @@ def put_org(org, payment_plan):
         print(e)
 
 
-def put_membership(org, member):
+def put_membership(org, member, buffer=None):
     created_at = datetime.datetime.now()
+    item = {
+        'PK': {'S': 'ACCOUNT#{}'.format(org)},
+        'SK': {'S': 'MEMBERSHIP#{}'.format(member)},
+        "Role": {"S": 'Member'},
+        "UserName": {"S": member},
+        "CreatedAt": {"S": created_at.isoformat()},
+    }
+    if buffer is not None:
+        # queued to go out in a batch, wait on the future it returns if you need to know it was written
+        return buffer.put(TABLE_NAME, item)
+
     try:
-        result = dynamodb.put_item(
-            TableName=TABLE_NAME,
-            Item={
-                'PK': {'S': 'ACCOUNT#{}'.format(org)},
-                'SK': {'S': 'MEMBERSHIP#{}'.format(member)},
-                "Role": {"S": 'Member'},
-                "UserName": {"S": member},
-                "CreatedAt": {"S": created_at.isoformat()},
-            }
-        )
+        result = dynamodb.put_item(TableName=TABLE_NAME, Item=item)
         print(result)
     except ClientError as e:
         print(e)
@@ -389,7 +442,8 @@ def put_repo_with_GSI_GSI2_GSI3_increment(account_id, repo_name):
 
 
 def query_user_info(account_name):
-    results = dynamodb.query(
+    results = query_all(
+        dynamodb,
         TableName=TABLE_NAME,
         IndexName='GSI3-index',
         ExpressionAttributeValues={
@@ -458,4 +512,11 @@ if __name__ == '__main__':
     get_issues_with_filter('jonathan.bradbury@gmail.com',
                            'Dynamo_is_awesome', 'OPEN')
 
+    # same answer, but it only reads the open issues
+    get_issues_by_status('jonathan.bradbury@gmail.com',
+                         'Dynamo_is_awesome', 'OPEN')
+
     get_repo_and_issues('jonathan.bradbury@gmail.com', 'Dynamo_is_awesome')
+
+    # latency, capacity, retries and throttles for everything above, per function
+    print(json.dumps(metrics.registry.snapshot(), indent=2))
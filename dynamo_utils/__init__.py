@@ -0,0 +1 @@
+'''Helpers shared by the chapter scripts. The scripts add the repo root to sys.path so they can import this package when run directly.'''
@@ -0,0 +1,45 @@
+import time
+
+'''BatchWriteItem with the retrying every script needs. Dynamo takes at most BATCH_WRITE_LIMIT requests per call and can hand any of them back
+in UnprocessedItems, usually because the table is being throttled, so those are sent again with an exponential backoff. After max_retries it
+gives up with an UnprocessedItemsError (a RuntimeError) instead of looping forever against a table that stays throttled. The error carries how
+many requests were written before it gave up, so callers can still report partial work.'''
+
+BATCH_WRITE_LIMIT = 25
+MAX_BATCH_RETRIES = 8
+
+
+class UnprocessedItemsError(RuntimeError):
+
+    def __init__(self, message, written, unprocessed):
+        super().__init__(message)
+        self.written = written
+        self.unprocessed = unprocessed
+
+
+def backoff(attempt):
+    time.sleep(min(0.05 * (2 ** attempt), 5))
+
+
+def batch_write_requests(client, requests, table_name, max_retries=MAX_BATCH_RETRIES):
+    '''Sends the write requests ({'PutRequest': ...} / {'DeleteRequest': ...}) 25 at a time and returns how many were written.'''
+    written = 0
+
+    for start in range(0, len(requests), BATCH_WRITE_LIMIT):
+        pending = requests[start:start + BATCH_WRITE_LIMIT]
+        attempt = 0
+
+        while pending:
+            response = client.batch_write_item(RequestItems={table_name: pending})
+            unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
+            written += len(pending) - len(unprocessed)
+            pending = unprocessed
+
+            if pending:
+                attempt += 1
+                if attempt > max_retries:
+                    raise UnprocessedItemsError('{} requests were still unprocessed after {} retries'.format(
+                        len(pending), max_retries), written, pending)
+                backoff(attempt)
+
+    return written
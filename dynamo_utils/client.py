@@ -0,0 +1,77 @@
+import os
+import threading
+
+from dynamo_utils import metrics
+
+'''One place to build the dynamodb client every script uses.
+boto3's defaults are a pool of 10 connections, legacy retries and 60 second timeouts. With a lot of threads sharing one client the pool runs out
+and requests queue up waiting for a connection, so we size the pool for the threads we actually run, keep connections alive, use adaptive retries
+(which also slows the client down when dynamo starts throttling) and use timeouts that fail fast.
+Every setting can come from the environment, DYNAMODB_ENDPOINT_URL points everything at dynamodb local or another stand-in for tests.
+get_client hands out one shared client per region / endpoint / settings. boto3 clients are thread safe, creating them is not,
+so creating happens under a lock.
+Nothing here imports boto3 until a client is actually needed. The scripts use lazy_client(), which doesn't build anything until the first call,
+so importing them does no I/O and doesn't load botocore's service models (that is most of a cold start in lambda).'''
+
+REGION = os.environ.get('DYNAMODB_REGION', 'us-east-1')
+ENDPOINT_URL = os.environ.get('DYNAMODB_ENDPOINT_URL') or None
+MAX_POOL_CONNECTIONS = int(os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS', 64))
+CONNECT_TIMEOUT = float(os.environ.get('DYNAMODB_CONNECT_TIMEOUT', 2))
+READ_TIMEOUT = float(os.environ.get('DYNAMODB_READ_TIMEOUT', 5))
+MAX_ATTEMPTS = int(os.environ.get('DYNAMODB_MAX_ATTEMPTS', 5))
+RETRY_MODE = os.environ.get('DYNAMODB_RETRY_MODE', 'adaptive')
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def client_config(max_pool_connections=MAX_POOL_CONNECTIONS, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                  max_attempts=MAX_ATTEMPTS, retry_mode=RETRY_MODE):
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=max_pool_connections,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={'mode': retry_mode, 'max_attempts': max_attempts},
+        tcp_keepalive=True
+    )
+
+
+def get_client(region_name=None, endpoint_url=None, **config):
+    '''Returns the shared client for these settings, building (and instrumenting) it the first time.
+    config takes the keyword arguments of client_config, e.g. get_client(max_pool_connections=128).'''
+    region_name = region_name or REGION
+    endpoint_url = endpoint_url or ENDPOINT_URL
+    key = (region_name, endpoint_url, tuple(sorted(config.items())))
+
+    with _clients_lock:
+        if key not in _clients:
+            import boto3
+
+            session = boto3.session.Session()
+            _clients[key] = metrics.instrument_client(session.client(
+                'dynamodb',
+                region_name=region_name,
+                endpoint_url=endpoint_url,
+                config=client_config(**config)
+            ))
+        return _clients[key]
+
+
+class LazyClient:
+    '''Stands in for a client and builds the real one (through get_client) the first time anything on it is used.'''
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._client = None
+
+    def __getattr__(self, name):
+        client = self._client
+        if client is None:
+            client = self._client = get_client(**self._kwargs)
+        return getattr(client, name)
+
+
+def lazy_client(**kwargs):
+    return LazyClient(**kwargs)
@@ -0,0 +1,141 @@
+from decimal import Clamped, Context, Decimal, Inexact, Overflow, Rounded, Underflow
+
+'''Converts between plain python values and dynamo's attribute values ({'S': ...}, {'N': ...}, {'M': {...}} ...) so items can be written as
+normal dicts. It does the same job as boto3's TypeSerializer / TypeDeserializer but looks the type up in a dict instead of going through a chain
+of isinstance checks, which makes it two to three times faster on the bulk paths (python -m dynamo_utils.codec_benchmark to compare).
+
+python          dynamo
+str             S
+int, Decimal    N       floats are refused like boto3 does, pass Decimal(str(value)) if you really mean it
+bool            BOOL
+None            NULL
+bytes           B
+list, tuple     L
+dict            M
+set of str      SS      sets can't be empty, dynamo doesn't allow it
+set of numbers  NS
+set of bytes    BS
+
+Numbers come back as int when they are whole numbers written without a decimal point or exponent and as Decimal otherwise, so nothing is
+rounded on the way through. B and BS come back as bytes.
+Numbers go through DYNAMODB_CONTEXT first, the same limits boto3 checks, so one with more than 38 significant digits or an exponent dynamo can't
+store raises decimal.Inexact / Rounded / Overflow / Underflow here instead of a ValidationException for the whole request.'''
+
+# dynamo's number type: 38 significant digits and exponents up to E+125, the same context as boto3.dynamodb.types.DYNAMODB_CONTEXT
+DYNAMODB_CONTEXT = Context(Emin=-128, Emax=126, prec=38, traps=[Clamped, Overflow, Inexact, Rounded, Underflow])
+
+# every int below this has at most 38 digits, so it can't break any of the limits and is sent as it is
+_SAFE_INT = 10 ** 38
+
+
+def _serialize_number(value):
+    return {'N': _number_string(value)}
+
+
+def _number_string(value):
+    if type(value) is int and -_SAFE_INT < value < _SAFE_INT:
+        return str(value)
+    if isinstance(value, Decimal) and not value.is_finite():
+        raise TypeError('Infinity and NaN are not supported: {!r}'.format(value))
+    if not isinstance(value, Decimal):
+        value = int(value)
+    return str(DYNAMODB_CONTEXT.create_decimal(value))
+
+
+def _serialize_float(value):
+    raise TypeError('Float types are not supported, use Decimal instead: {!r}'.format(value))
+
+
+def _serialize_list(value):
+    return {'L': [{'S': element} if type(element) is str else serialize(element) for element in value]}
+
+
+def _serialize_map(value):
+    return {'M': {key: {'S': element} if type(element) is str else serialize(element) for key, element in value.items()}}
+
+
+def _serialize_set(value):
+    if not value:
+        raise TypeError('Empty sets are not supported')
+    first = type(next(iter(value)))
+    if first is str:
+        return {'SS': list(value)}
+    if first in (bytes, bytearray):
+        return {'BS': [bytes(element) for element in value]}
+    if first in (int, Decimal):
+        return {'NS': [_number_string(element) for element in value]}
+    raise TypeError('Unsupported set element type: {}'.format(first.__name__))
+
+
+_SERIALIZERS = {
+    str: lambda value: {'S': value},
+    bool: lambda value: {'BOOL': value},
+    int: _serialize_number,
+    Decimal: _serialize_number,
+    float: _serialize_float,
+    type(None): lambda value: {'NULL': True},
+    bytes: lambda value: {'B': value},
+    bytearray: lambda value: {'B': bytes(value)},
+    list: _serialize_list,
+    tuple: _serialize_list,
+    dict: _serialize_map,
+    set: _serialize_set,
+    frozenset: _serialize_set
+}
+
+
+def serialize(value):
+    value_type = type(value)
+    # strings are most of what gets written (every key is one), so they skip the lookup
+    if value_type is str:
+        return {'S': value}
+    serializer = _SERIALIZERS.get(value_type)
+    if serializer is None:
+        # subclasses (OrderedDict, an IntEnum ...) are rare, so they take the slow way round
+        for python_type, serializer in _SERIALIZERS.items():
+            if isinstance(value, python_type):
+                break
+        else:
+            raise TypeError('Unsupported type "{}" for value "{!r}"'.format(value_type.__name__, value))
+    return serializer(value)
+
+
+def _deserialize_number(value):
+    if value.isdigit() or (value[0] == '-' and value[1:].isdigit()):
+        return int(value)
+    return Decimal(value)
+
+
+_DESERIALIZERS = {
+    'S': lambda value: value,
+    'N': _deserialize_number,
+    'BOOL': lambda value: value,
+    'NULL': lambda value: None,
+    'B': bytes,
+    'L': lambda value: [deserialize(element) for element in value],
+    'M': lambda value: {key: element['S'] if 'S' in element else deserialize(element) for key, element in value.items()},
+    'SS': set,
+    'NS': lambda value: {_deserialize_number(element) for element in value},
+    'BS': lambda value: {bytes(element) for element in value}
+}
+
+
+def deserialize(attribute_value):
+    for tag, value in attribute_value.items():
+        if tag == 'S':
+            return value
+        try:
+            deserializer = _DESERIALIZERS[tag]
+        except KeyError:
+            raise TypeError('Dynamodb type "{}" is not supported'.format(tag)) from None
+        return deserializer(value)
+    raise TypeError('Attribute value is empty')
+
+
+def serialize_item(item):
+    '''A whole item, {'PK': 'REPO#...', 'Count': 3} -> {'PK': {'S': 'REPO#...'}, 'Count': {'N': '3'}}.'''
+    return {key: {'S': value} if type(value) is str else serialize(value) for key, value in item.items()}
+
+
+def deserialize_item(item):
+    return {key: value['S'] if 'S' in value else deserialize(value) for key, value in item.items()}
@@ -0,0 +1,111 @@
+import argparse
+import gc
+import time
+from decimal import Decimal
+
+from dynamo_utils.codec import deserialize_item, serialize_item
+
+'''Times dynamo_utils.codec against boto3's TypeSerializer / TypeDeserializer on the same items, one shape per kind of item the scripts write:
+a flat issue, an order with Decimal prices, and a customer with a nested Addresses map plus a set. boto3 is only needed for the comparison,
+without it just the codec is timed. It also round trips a sample through both to check they agree on the wire format.
+
+python -m dynamo_utils.codec_benchmark
+python -m dynamo_utils.codec_benchmark --items 100000'''
+
+
+def sample_items(count):
+    shapes = [
+        lambda number: {
+            'PK': 'REPO#jonathanbradbury#dynamodb_examples',
+            'SK': 'ISSUE#{}'.format(str(number).zfill(9)),
+            'RepoName': 'dynamodb_examples',
+            'RepoOwner': 'jonathanbradbury',
+            'Created_At': '2020-07-08T09:00:00',
+            'IssueNumber': number,
+            'Status': 'Open'
+        },
+        lambda number: {
+            'PK': 'ORDER#01ECGPW001CM7KKWW13X1P2KV7#ITEM#{}'.format(number),
+            'SK': 'ORDER#01ECGPW001CM7KKWW13X1P2KV7#ITEM#{}'.format(number),
+            'item_id': str(number),
+            'Description': 'Tacos & Bells',
+            'Price': Decimal('67.43'),
+            'Quantity': 2
+        },
+        lambda number: {
+            'PK': 'CUSTOMER#customer_{}'.format(number),
+            'SK': 'CUSTOMER#customer_{}'.format(number),
+            'Username': 'customer_{}'.format(number),
+            'Addresses': {
+                'Home': {'Street': '123 Fake Street', 'City': 'Fake City', 'Zip': 92617},
+                'Business': {'Street': '1 Taco Way', 'City': 'Taco City', 'Zip': 92618}
+            },
+            'Tags': {'new', 'bulk'},
+            'Active': True
+        }
+    ]
+    return [shapes[number % len(shapes)](number) for number in range(count)]
+
+
+def _time(function, items):
+    # like timeit, keep the garbage collector out of it. With a million items alive it would otherwise run over and over and be most of the time
+    gc.collect()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        result = [function(item) for item in items]
+        return result, time.perf_counter() - started
+    finally:
+        gc.enable()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    items = sample_items(args.items)
+    encoded, seconds = _time(serialize_item, items)
+    report = {'codec': {'serialize_seconds': seconds}}
+    decoded, report['codec']['deserialize_seconds'] = _time(deserialize_item, encoded)
+    assert decoded[:1000] == items[:1000], 'the codec did not round trip'
+
+    try:
+        from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+    except ImportError:
+        print('boto3 is not installed, only timing the codec')
+    else:
+        serializer = TypeSerializer()
+        deserializer = TypeDeserializer()
+
+        def boto3_serialize(item):
+            return {key: serializer.serialize(value) for key, value in item.items()}
+
+        def boto3_deserialize(item):
+            return {key: deserializer.deserialize(value) for key, value in item.items()}
+
+        boto3_encoded, seconds = _time(boto3_serialize, items)
+        report['boto3'] = {'serialize_seconds': seconds}
+        _, report['boto3']['deserialize_seconds'] = _time(boto3_deserialize, boto3_encoded)
+
+        # sets have no order, so compare them as sets
+        for ours, theirs in zip(encoded[:1000], boto3_encoded[:1000]):
+            for key in ours:
+                if 'SS' in ours[key]:
+                    assert set(ours[key]['SS']) == set(theirs[key]['SS']), key
+                else:
+                    assert ours[key] == theirs[key], (key, ours[key], theirs[key])
+
+    for name, timings in report.items():
+        print('{:<6} serialize {:>8.2f}s ({:>9,.0f} items/s)   deserialize {:>8.2f}s ({:>9,.0f} items/s)'.format(
+            name, timings['serialize_seconds'], args.items / timings['serialize_seconds'],
+            timings['deserialize_seconds'], args.items / timings['deserialize_seconds']))
+    if 'boto3' in report:
+        print('codec is {:.1f}x faster serializing and {:.1f}x faster deserializing'.format(
+            report['boto3']['serialize_seconds'] / report['codec']['serialize_seconds'],
+            report['boto3']['deserialize_seconds'] / report['codec']['deserialize_seconds']))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+'''Tracks how long each script takes to import, using python -X importtime in a fresh interpreter for every module.
+For each module it reports the cumulative import time, the heaviest imports underneath it, and whether boto3 / botocore's client machinery got
+loaded (it shouldn't, the client is built on first use). Pass --history to append the results to a json lines file so you can watch it over time.
+
+python -m dynamo_utils.importtime
+python -m dynamo_utils.importtime --runs 5 --history importtime.jsonl'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    ('chapter_18', 'chapter_18'),
+    ('chapter_18', 'chapter_18_async'),
+    ('chapter_19', 'chapter_19'),
+    ('chapter_21', 'chapter_21'),
+    ('chapter_21', 'chapter_21_condensed'),
+    ('lunch_and_learn', 'examples'),
+]
+
+HEAVY_MODULES = ('boto3', 'botocore.client', 'botocore.loaders')
+
+
+def measure(directory, module):
+    paths = [os.path.join(ROOT, directory), ROOT]
+    if os.environ.get('PYTHONPATH'):
+        paths.append(os.environ['PYTHONPATH'])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(paths))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError('importing {} failed:\n{}'.format(
+            module, result.stderr))
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    total = next(cumulative for name, self_us,
+                 cumulative in imports if name == module)
+    return {
+        'module': module,
+        'cumulative_ms': total / 1000,
+        'heaviest': [{'module': name, 'cumulative_ms': cumulative / 1000}
+                     for name, self_us, cumulative in sorted(imports, key=lambda entry: -entry[2])[1:6]],
+        'loads_heavy_modules': sorted({name for name, self_us, cumulative in imports if name in HEAVY_MODULES})
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=3,
+                        help='imports per module, the fastest one is kept')
+    parser.add_argument('--history', help='json lines file to append to')
+    args = parser.parse_args(argv)
+
+    results = []
+    for directory, module in MODULES:
+        runs = [measure(directory, module) for _ in range(args.runs)]
+        results.append(min(runs, key=lambda run: run['cumulative_ms']))
+
+    for result in results:
+        print('{:<24} {:>9.1f} ms   heavy modules loaded: {}'.format(
+            result['module'], result['cumulative_ms'], ', '.join(result['loads_heavy_modules']) or 'none'))
+
+    if args.history:
+        with open(args.history, 'a') as history:
+            history.write(json.dumps({
+                'measured_at': datetime.datetime.now().isoformat(),
+                'python': sys.version.split()[0],
+                'results': results
+            }) + '\n')
+    return results
+
+
+if __name__ == '__main__':
+    main()
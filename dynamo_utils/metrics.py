@@ -0,0 +1,305 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+'''Instrumentation for the dynamodb clients the scripts use. instrument_client hooks into botocore's event system, so none of the access
+pattern functions have to change. For every call it records:
+• latency, as a histogram per access pattern function (get_repo_and_issues, query_items_by_order ...) and operation
+• consumed capacity per table and index, split into read and write. ReturnConsumedCapacity=INDEXES is added to any call that didn't ask for it
+• errors by code, throttles, and retries (every attempt after the first one botocore makes)
+The function is the first frame on the stack outside of botocore / boto3 / this package. Code that calls dynamo from a worker thread
+can name it with label().
+Read it with registry.snapshot() (a dict you can json.dumps), registry.prometheus_text(), or serve both over http with serve_metrics().'''
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+THROTTLE_CODES = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded'
+}
+
+READ_OPERATIONS = {'GetItem', 'Query', 'Scan',
+                   'BatchGetItem', 'TransactGetItems'}
+
+CAPACITY_OPERATIONS = READ_OPERATIONS | {
+    'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems'}
+
+# frames from these packages are never the access pattern
+SKIPPED_MODULES = {'botocore', 'boto3', 'dynamo_utils',
+                   'concurrent', 'threading', 'asyncio', 'contextlib'}
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latency = {}
+            self.errors = {}
+            self.capacity = {}
+            self.attempts = {}
+            self.throttles = {}
+
+    def record_call(self, function, operation, seconds, error_code=None):
+        with self._lock:
+            key = (function, operation)
+            if key not in self.latency:
+                self.latency[key] = Histogram()
+            self.latency[key].observe(seconds)
+            if error_code:
+                key = (function, operation, error_code)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def record_capacity(self, table, index, kind, units):
+        with self._lock:
+            key = (table, index, kind)
+            self.capacity[key] = self.capacity.get(key, 0.0) + units
+
+    def record_attempt(self, operation):
+        with self._lock:
+            self.attempts[operation] = self.attempts.get(operation, 0) + 1
+
+    def record_throttle(self, operation):
+        with self._lock:
+            self.throttles[operation] = self.throttles.get(operation, 0) + 1
+
+    def _calls_by_operation(self):
+        calls = {}
+        for (function, operation), histogram in self.latency.items():
+            calls[operation] = calls.get(operation, 0) + histogram.count
+        return calls
+
+    def snapshot(self):
+        with self._lock:
+            calls = self._calls_by_operation()
+            return {
+                'latency': [{
+                    'function': function,
+                    'operation': operation,
+                    'count': histogram.count,
+                    'sum_seconds': histogram.sum,
+                    'buckets': {str(bound): count for bound, count in histogram.cumulative()}
+                } for (function, operation), histogram in self.latency.items()],
+                'errors': [{'function': function, 'operation': operation, 'code': code, 'count': count}
+                           for (function, operation, code), count in self.errors.items()],
+                'consumed_capacity': [{'table': table, 'index': index, 'kind': kind, 'units': units}
+                                      for (table, index, kind), units in self.capacity.items()],
+                'retries': {operation: max(attempts - calls.get(operation, 0), 0)
+                            for operation, attempts in self.attempts.items()},
+                'throttles': dict(self.throttles)
+            }
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            calls = self._calls_by_operation()
+
+            lines.append(
+                '# HELP dynamodb_call_latency_seconds DynamoDB call latency by access pattern function and operation')
+            lines.append('# TYPE dynamodb_call_latency_seconds histogram')
+            for (function, operation), histogram in sorted(self.latency.items()):
+                labels = _labels(function=function, operation=operation)
+                for bound, count in histogram.cumulative():
+                    lines.append('dynamodb_call_latency_seconds_bucket{{{},le="{}"}} {}'.format(
+                        labels, bound, count))
+                lines.append('dynamodb_call_latency_seconds_bucket{{{},le="+Inf"}} {}'.format(
+                    labels, histogram.count))
+                lines.append('dynamodb_call_latency_seconds_sum{{{}}} {}'.format(
+                    labels, histogram.sum))
+                lines.append('dynamodb_call_latency_seconds_count{{{}}} {}'.format(
+                    labels, histogram.count))
+
+            lines.append(
+                '# HELP dynamodb_errors_total DynamoDB calls that failed, by error code')
+            lines.append('# TYPE dynamodb_errors_total counter')
+            for (function, operation, code), count in sorted(self.errors.items()):
+                lines.append('dynamodb_errors_total{{{}}} {}'.format(
+                    _labels(function=function, operation=operation, code=code), count))
+
+            lines.append(
+                '# HELP dynamodb_consumed_capacity_units_total Capacity units consumed per table and index')
+            lines.append('# TYPE dynamodb_consumed_capacity_units_total counter')
+            for (table, index, kind), units in sorted(self.capacity.items()):
+                lines.append('dynamodb_consumed_capacity_units_total{{{}}} {}'.format(
+                    _labels(table=table, index=index, kind=kind), units))
+
+            lines.append(
+                '# HELP dynamodb_retries_total Attempts botocore made after the first one')
+            lines.append('# TYPE dynamodb_retries_total counter')
+            for operation, attempts in sorted(self.attempts.items()):
+                lines.append('dynamodb_retries_total{{{}}} {}'.format(
+                    _labels(operation=operation), max(attempts - calls.get(operation, 0), 0)))
+
+            lines.append(
+                '# HELP dynamodb_throttles_total Attempts that were throttled')
+            lines.append('# TYPE dynamodb_throttles_total counter')
+            for operation, count in sorted(self.throttles.items()):
+                lines.append('dynamodb_throttles_total{{{}}} {}'.format(
+                    _labels(operation=operation), count))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in labels.items())
+
+
+registry = Metrics()
+
+_local = threading.local()
+
+
+@contextmanager
+def label(function):
+    '''Attributes every call made inside the block to function instead of looking at the stack.'''
+    previous = getattr(_local, 'function', None)
+    _local.function = function
+    try:
+        yield
+    finally:
+        _local.function = previous
+
+
+def current_function():
+    labelled = getattr(_local, 'function', None)
+    if labelled:
+        return labelled
+
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.split('.')[0] not in SKIPPED_MODULES:
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return 'unknown'
+
+
+def _add_capacity(registry, consumed, kind, index_name):
+    table = consumed.get('TableName', '')
+    breakdown = False
+    if 'Table' in consumed:
+        registry.record_capacity(
+            table, '', kind, consumed['Table'].get('CapacityUnits', 0))
+        breakdown = True
+    for key in ('GlobalSecondaryIndexes', 'LocalSecondaryIndexes'):
+        for index, units in consumed.get(key, {}).items():
+            registry.record_capacity(
+                table, index, kind, units.get('CapacityUnits', 0))
+            breakdown = True
+    if not breakdown:
+        registry.record_capacity(
+            table, index_name or '', kind, consumed.get('CapacityUnits', 0))
+
+
+def instrument_client(client, registry=registry):
+    '''Registers the handlers on a boto3 dynamodb client and returns it. Calling it twice on the same client does nothing.'''
+    if getattr(client, '_dynamo_utils_instrumented', False):
+        return client
+
+    def add_consumed_capacity(params, model, **kwargs):
+        if model.name in CAPACITY_OPERATIONS and 'ReturnConsumedCapacity' not in params:
+            params['ReturnConsumedCapacity'] = 'INDEXES'
+
+    def before_call(model, params, context, **kwargs):
+        context['metrics_function'] = current_function()
+        context['metrics_index'] = params.get('IndexName')
+        context['metrics_started'] = time.perf_counter()
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        if 'metrics_started' not in context:
+            return
+        error_code = parsed.get('Error', {}).get('Code')
+        registry.record_call(context['metrics_function'], model.name,
+                             time.perf_counter() - context['metrics_started'], error_code)
+
+        kind = 'read' if model.name in READ_OPERATIONS else 'write'
+        consumed = parsed.get('ConsumedCapacity')
+        for entry in consumed if isinstance(consumed, list) else [consumed] if consumed else []:
+            _add_capacity(registry, entry, kind, context['metrics_index'])
+
+    def after_call_error(exception, context, **kwargs):
+        if 'metrics_started' not in context:
+            return
+        registry.record_call(context['metrics_function'], context.get('metrics_operation', 'unknown'),
+                             time.perf_counter() - context['metrics_started'], type(exception).__name__)
+
+    def before_parameter_build(params, model, context, **kwargs):
+        context['metrics_operation'] = model.name
+
+    def before_send(event_name, **kwargs):
+        registry.record_attempt(event_name.rsplit('.', 1)[-1])
+
+    def needs_retry(response, operation, **kwargs):
+        if response is not None and response[1].get('Error', {}).get('Code') in THROTTLE_CODES:
+            registry.record_throttle(operation.name)
+
+    events = client.meta.events
+    events.register('provide-client-params.dynamodb', add_consumed_capacity)
+    events.register('before-parameter-build.dynamodb', before_parameter_build)
+    events.register('before-call.dynamodb', before_call)
+    events.register('after-call.dynamodb', after_call)
+    events.register('after-call-error.dynamodb', after_call_error)
+    events.register('before-send.dynamodb', before_send)
+    events.register('needs-retry.dynamodb', needs_retry)
+    client._dynamo_utils_instrumented = True
+    return client
+
+
+def serve_metrics(port=9102, registry=registry):
+    '''Serves /metrics (prometheus text) and /metrics.json (the snapshot) from a daemon thread.'''
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = registry.prometheus_text().encode()
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body = json.dumps(registry.snapshot()).encode()
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(('', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,271 @@
+import datetime
+from decimal import Decimal
+
+from dynamo_utils.codec import _deserialize_number, deserialize
+
+'''Small typed classes for the entities the scripts store, built straight from the items a query returns.
+A query result is a list of nested dicts, {'RepoName': {'S': 'dynamodb_examples'}, ...}, and holding on to 100k of them costs a few KB each in dict
+overhead. An entity only keeps the payload of the attributes it knows about (the 'dynamodb_examples' string, not the dicts around it) in __slots__,
+and turns it into a python value when you read the field, so building one is cheap and fields you never look at are never decoded.
+from_item picks the class from the PK / SK prefixes (REPO# + ISSUE# is an Issue, ACCOUNT# + MEMBERSHIP# is a Membership ...) and returns None
+for items that aren't entities, like the CUSTOMEREMAIL# uniqueness items or the #COUNT# counter shards.
+
+entities = from_items(get_repo_and_issues('jonathanbradbury', 'dynamodb_examples')['Items'])
+print([issue.number for issue in entities if isinstance(issue, Issue)])'''
+
+
+def _strip(prefix):
+    return lambda value: value[len(prefix):] if value.startswith(prefix) else None
+
+
+_DEFAULT_DECODERS = {
+    'S': lambda value: value,
+    'N': _deserialize_number,
+    'BOOL': lambda value: value
+}
+
+
+class Field:
+    '''One attribute of an entity. tag is the dynamo type it is stored as, and only that payload is kept. decode turns the payload into the
+    value you get back, by default the same as the codec would. With tag=None any type is accepted and the whole attribute value is kept.'''
+
+    def __init__(self, attribute, tag='S', decode=None):
+        self.attribute = attribute
+        self.tag = tag
+        if decode is None:
+            decode = _DEFAULT_DECODERS.get(tag) or (lambda value, tag=tag: deserialize({tag: value}))
+        self.decode = decode
+        self.name = None
+        self.slot = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, entity, owner=None):
+        if entity is None:
+            return self
+        raw = self.slot.__get__(entity, owner)
+        if raw is None:
+            return None
+        return self.decode(raw)
+
+
+def _created_at(attribute):
+    return Field(attribute, decode=datetime.datetime.fromisoformat)
+
+
+class _EntityType(type):
+    '''Gives every entity class one slot per Field, named after the field with a leading underscore.'''
+
+    def __new__(mcs, name, bases, namespace):
+        fields = [value for value in namespace.values() if isinstance(value, Field)]
+        namespace['__slots__'] = tuple('_' + field_name for field_name, value in namespace.items()
+                                       if isinstance(value, Field))
+        cls = super().__new__(mcs, name, bases, namespace)
+        for field in fields:
+            field.slot = cls.__dict__['_' + field.name]
+        cls._fields = getattr(cls, '_fields', ()) + tuple(fields)
+        return cls
+
+
+class Entity(metaclass=_EntityType):
+    pk = Field('PK')
+    sk = Field('SK')
+
+    @classmethod
+    def from_item(cls, item):
+        entity = cls.__new__(cls)
+        for field in cls._fields:
+            attribute_value = item.get(field.attribute)
+            if attribute_value is None:
+                raw = None
+            elif field.tag is None:
+                raw = attribute_value
+            else:
+                try:
+                    raw = attribute_value[field.tag]
+                except KeyError:
+                    raise TypeError('{}.{} should be stored as {} but is {}'.format(
+                        cls.__name__, field.name, field.tag, attribute_value)) from None
+            field.slot.__set__(entity, raw)
+        return entity
+
+    def to_dict(self):
+        return {field.name: getattr(self, field.name) for field in self._fields}
+
+    def to_item(self):
+        '''Back to a wire format item, with only the attributes this class knows about.'''
+        item = {}
+        for field in self._fields:
+            raw = field.slot.__get__(self)
+            if raw is not None:
+                item[field.attribute] = raw if field.tag is None else {field.tag: raw}
+        return item
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            field.slot.__get__(self) == field.slot.__get__(other) for field in self._fields)
+
+    def __hash__(self):
+        return hash((type(self), self._pk, self._sk))
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(name, value) for name, value in self.to_dict().items() if name not in ('pk', 'sk')))
+
+
+class Repo(Entity):
+    owner = Field('RepoOwner')
+    name = Field('RepoName')
+    created_at = _created_at('Created_At')
+    issues_and_pull_request_count = Field('IssuesAndPullRequestCount', 'N')
+    star_count = Field('StarCount', 'N')
+    fork_count = Field('ForkCount', 'N')
+
+
+class Fork(Repo):
+    # GSI2PK is REPO#<owner>#<repo> of the repo this one was forked from
+    forked_from = Field('GSI2PK', decode=lambda key: tuple(key.split('#', 2)[1:]))
+
+
+class Issue(Entity):
+    owner = Field('RepoOwner')
+    repo = Field('RepoName')
+    number = Field('IssueNumber', 'N')
+    status = Field('Status')
+    created_at = _created_at('Created_At')
+
+
+class PullRequest(Entity):
+    owner = Field('RepoOwner')
+    repo = Field('RepoName')
+    number = Field('PullRquestNumber', 'N')
+    created_at = _created_at('Created_At')
+
+
+class Star(Entity):
+    owner = Field('RepoOwner')
+    repo = Field('RepoName')
+    user = Field('StarringUser')
+
+
+class Account(Entity):
+    name = Field('PK', decode=_strip('ACCOUNT#'))
+    type = Field('Type')
+    created_at = _created_at('CreatedAt')
+    organizations = Field('Organizations', 'M')
+    payment_plan = Field('PaymentPlan', 'M')
+
+
+class Membership(Entity):
+    organization = Field('PK', decode=_strip('ACCOUNT#'))
+    user = Field('UserName')
+    role = Field('Role')
+    created_at = _created_at('CreatedAt')
+
+
+class Customer(Entity):
+    username = Field('Username')
+    email = Field('Email address')
+    name = Field('Name')
+    addresses = Field('Addresses', 'M')
+
+
+class Order(Entity):
+    customer_id = Field('PK', decode=_strip('CUSTOMER#'))
+    order_id = Field('order_id')
+    created_at = _created_at('created_at')
+    status = Field('status')
+    amount = Field('Amount', 'N', Decimal)
+    number_items = Field('number_items', 'N')
+
+
+class OrderItem(Entity):
+    order_id = Field('GSI1PK', decode=_strip('ORDER#'))
+    item_id = Field('item_id')
+    description = Field('Description')
+    price = Field('Price', 'N', Decimal)
+
+
+class Owner(Entity):
+    name = Field('PK', decode=_strip('OWNER#'))
+    franchise_name = Field('FranchiseName')
+    phone = Field('OwnerPhone')
+    email = Field('OwnerEmail')
+    ppp = Field('PPP')
+    created_at = _created_at('Created_At')
+
+
+class Store(Entity):
+    # stores added with add_store_to_owner live under the owner, ones added with add_store under themselves
+    owner = Field('PK', decode=_strip('OWNER#'))
+    store_number = Field('SK', decode=_strip('STORE#'))
+    phone = Field('StorePhone')
+    email = Field('StoreEmail')
+    address = Field('StoreAddress')
+    status = Field('Status')
+    territory = Field('Territory')
+    region = Field('Region')
+    market = Field('Market')
+    area = Field('Area')
+    created_at = _created_at('Created_At')
+
+
+class Employee(Entity):
+    store_number = Field('PK', decode=_strip('STORE#'))
+    employee_id = Field('SK', decode=_strip('EMPLOYEE#'))
+    name = Field('Name')
+    age = Field('Age', 'N')
+    role = Field('Role')
+    created_at = _created_at('Created_At')
+
+
+class MenuItem(Entity):
+    store_number = Field('PK', decode=_strip('STORE#'))
+    item_id = Field('ItemID')
+    # the menu stores prices as strings
+    price = Field('Price', decode=Decimal)
+    tax = Field('Tax', decode=Decimal)
+    description = Field('description')
+    created_at = _created_at('Created_At')
+
+
+# (PK prefix, SK prefix, class), the first match wins
+ENTITY_TYPES = [
+    ('REPO#', 'REPO#', Repo),
+    ('REPO#', 'ISSUE#', Issue),
+    ('REPO#', 'STAR#', Star),
+    ('PR#', 'PR#', PullRequest),
+    ('ACCOUNT#', 'ACCOUNT#', Account),
+    ('ACCOUNT#', 'MEMBERSHIP#', Membership),
+    ('CUSTOMER#', 'CUSTOMER#', Customer),
+    ('CUSTOMER#', '#ORDER#', Order),
+    ('ORDER#', 'ORDER#', OrderItem),
+    ('OWNER#', 'OWNER#', Owner),
+    ('OWNER#', 'STORE#', Store),
+    ('STORE#', 'STORE#', Store),
+    ('STORE#', 'EMPLOYEE#', Employee),
+    ('STORE#', 'ITEM#', MenuItem)
+]
+
+
+def entity_type(item):
+    pk = item['PK']['S']
+    sk = item['SK']['S']
+    for pk_prefix, sk_prefix, cls in ENTITY_TYPES:
+        if pk.startswith(pk_prefix) and sk.startswith(sk_prefix):
+            # a fork is a repo item that points at the repo it came from with GSI2SK = FORK#<owner>
+            if cls is Repo and item.get('GSI2SK', {}).get('S', '').startswith('FORK#'):
+                return Fork
+            return cls
+    return None
+
+
+def from_item(item):
+    cls = entity_type(item)
+    return cls.from_item(item) if cls is not None else None
+
+
+def from_items(items):
+    '''Entities for the items that are one, in the same order. Works on a list or straight on iter_query.'''
+    return [entity for entity in map(from_item, items) if entity is not None]
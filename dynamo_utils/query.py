@@ -0,0 +1,142 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from dynamo_utils.metrics import current_function, label
+
+'''Reads every page of a query instead of stopping at the first 1 MB. iter_query hands back the items one at a time and only fetches a page when
+it is needed. With prefetch on (the default) the next page is requested on a background thread as soon as the current one arrives, so the
+round trip overlaps with whatever the caller does with the items.
+Two budgets stop it early: max_items stops after that many items, and max_rcu stops asking for pages once the pages read so far have used that
+many read capacity units. A page in flight is never cut short, so it can go over max_rcu by up to one page.
+query_all does the same thing but collects everything into a dict shaped like a query response (Items, Count, ScannedCount, ConsumedCapacity,
+and LastEvaluatedKey if a budget stopped it), so functions that used to return the first page can return all of them without callers changing.
+
+for item in iter_query(dynamodb, TableName='...', KeyConditionExpression='...', ExpressionAttributeValues={...}):
+    ...'''
+
+# prefetching is waiting on the network, not the cpu, so this can be a lot bigger than the core count
+PREFETCH_WORKERS = 32
+
+_prefetch_executor = ThreadPoolExecutor(
+    max_workers=PREFETCH_WORKERS, thread_name_prefix='dynamo-prefetch')
+
+# (TableName, IndexName) -> the attribute names a LastEvaluatedKey has for a query on it, filled in from DescribeTable the first time it's needed
+_key_names_cache = {}
+
+
+def _key_schema_names(client, table_name, index_name=None):
+    '''The key attributes of the table, plus the index's own when the query is on an index, which is what dynamo puts in a LastEvaluatedKey.'''
+    cache_key = (table_name, index_name)
+    if cache_key not in _key_names_cache:
+        table = client.describe_table(TableName=table_name)['Table']
+        names = [key['AttributeName'] for key in table['KeySchema']]
+        for index in table.get('GlobalSecondaryIndexes', []) + table.get('LocalSecondaryIndexes', []):
+            if index['IndexName'] == index_name:
+                names += [key['AttributeName'] for key in index['KeySchema'] if key['AttributeName'] not in names]
+        _key_names_cache[cache_key] = tuple(names)
+    return _key_names_cache[cache_key]
+
+
+class QueryIterator:
+    '''Iterate it for the items. Count, ScannedCount, consumed capacity and pages are kept up to date as it goes, and last_evaluated_key is
+    where to start again if a budget stopped it (None once the query is finished).
+    When max_items stops it part way through a page the key is built from the last item handed out, using key_attributes if you pass them,
+    otherwise the attributes of a LastEvaluatedKey dynamo already sent, otherwise the table's key schema.'''
+
+    def __init__(self, client, max_items=None, max_rcu=None, prefetch=True, key_attributes=None, **params):
+        self.client = client
+        self.max_items = max_items
+        self.max_rcu = max_rcu
+        self.prefetch = prefetch
+        self.key_attributes = key_attributes
+        self.params = params
+        if max_rcu is not None:
+            self.params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+        self.count = 0
+        self.scanned_count = 0
+        self.consumed_capacity = 0.0
+        self.pages = 0
+        self.last_evaluated_key = None
+        # the prefetch thread's calls should show up in metrics under the function that started the query
+        self._function = current_function()
+        self._received = 0
+
+    def __iter__(self):
+        return self._items()
+
+    def _query(self, params):
+        with label(self._function):
+            return self.client.query(**params)
+
+    def _request(self, start_key):
+        params = dict(self.params)
+        if start_key is not None:
+            params['ExclusiveStartKey'] = start_key
+        if self.max_items is not None and 'FilterExpression' not in params:
+            # without a filter every item read is returned, so there's no point reading more than we still need
+            remaining = self.max_items - self._received
+            params['Limit'] = min(params.get('Limit', remaining), remaining)
+
+        if self.prefetch:
+            return _prefetch_executor.submit(self._query, params).result
+        return functools.partial(self._query, params)
+
+    def _more(self):
+        return (self.last_evaluated_key is not None
+                and (self.max_items is None or self._received < self.max_items)
+                and (self.max_rcu is None or self.consumed_capacity < self.max_rcu))
+
+    def _key_names(self):
+        if self.key_attributes is None:
+            start_key = self.params.get('ExclusiveStartKey')
+            if start_key is not None:
+                self.key_attributes = tuple(start_key)
+            else:
+                self.key_attributes = _key_schema_names(self.client, self.params['TableName'], self.params.get('IndexName'))
+        return self.key_attributes
+
+    def _items(self):
+        if self.max_items is not None and self.max_items <= 0:
+            # dynamo refuses Limit=0, and there is nothing to read anyway. Resuming starts where this one would have
+            self.last_evaluated_key = self.params.get('ExclusiveStartKey')
+            return
+        pending = self._request(self.params.get('ExclusiveStartKey'))
+        while pending is not None:
+            page = pending()
+            self.pages += 1
+            self._received += len(page['Items'])
+            self.scanned_count += page.get('ScannedCount', len(page['Items']))
+            self.consumed_capacity += page.get('ConsumedCapacity', {}).get('CapacityUnits', 0)
+            self.last_evaluated_key = page.get('LastEvaluatedKey')
+            if self.key_attributes is None and self.last_evaluated_key is not None:
+                self.key_attributes = tuple(self.last_evaluated_key)
+
+            pending = self._request(self.last_evaluated_key) if self._more() else None
+            for index, item in enumerate(page['Items']):
+                if self.max_items is not None and self.count >= self.max_items:
+                    # stopped part way through a page, so carry on from the last item we handed out
+                    last = page['Items'][index - 1]
+                    self.last_evaluated_key = {name: last[name] for name in self._key_names()}
+                    return
+                self.count += 1
+                yield item
+
+
+def iter_query(client, max_items=None, max_rcu=None, prefetch=True, key_attributes=None, **params):
+    return QueryIterator(client, max_items=max_items, max_rcu=max_rcu, prefetch=prefetch, key_attributes=key_attributes, **params)
+
+
+def query_all(client, max_items=None, max_rcu=None, key_attributes=None, **params):
+    '''Everything a query matches in one response shaped dict. Nothing happens between pages here, so it doesn't prefetch.'''
+    query = QueryIterator(client, max_items=max_items, max_rcu=max_rcu, prefetch=False, key_attributes=key_attributes, **params)
+    result = {
+        'Items': list(query),
+        'Count': query.count,
+        'ScannedCount': query.scanned_count
+    }
+    if 'ReturnConsumedCapacity' in params or max_rcu is not None:
+        result['ConsumedCapacity'] = {'TableName': params.get('TableName'), 'CapacityUnits': query.consumed_capacity}
+    if query.last_evaluated_key is not None:
+        result['LastEvaluatedKey'] = query.last_evaluated_key
+    return result
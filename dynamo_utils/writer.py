@@ -0,0 +1,224 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from dynamo_utils import metrics
+from dynamo_utils.batch import BATCH_WRITE_LIMIT, MAX_BATCH_RETRIES, backoff
+
+'''A write-behind buffer for puts nobody needs to wait on. put() queues the item and returns straight away with a Future, a background thread
+groups what's queued into BatchWriteItem requests of up to 25 and sends them. A batch goes out when it is full, when its oldest item has waited
+max_age seconds, when you call flush(), or when the buffer is closed (close(), the end of a with block, or interpreter exit).
+• UnprocessedItems are sent again with exponential backoff, a future only fails once its item has used up max_retries.
+• the queue holds at most max_pending items, put() blocks when it is full so a fast producer can't run away from dynamo.
+• puts of the same key are written in the order they were made. The flusher thread sends every batch itself and waits for it (retries
+  included) before starting the next one, so a later put can never overtake an earlier one in another batch.
+• BatchWriteItem refuses two writes to the same key in one request, so if the same key is put twice before its batch goes out the last item
+  wins and both futures complete when it is written.
+• if the flusher thread hits an error it fails every queued future with it, and put() and flush() raise from then on instead of hanging.
+• it's only for unconditional puts, BatchWriteItem can't take a ConditionExpression.
+Call future.result() if you need to know the item is in dynamo, or flush() to wait for everything queued so far.
+
+with WriteBehindBuffer(dynamodb) as buffer:
+    for user in users:
+        add_stars_to_repo('jonathanbradbury', 'another_example', user, buffer=buffer)'''
+
+MAX_AGE = 0.05
+MAX_PENDING = 10000
+
+_FLUSH = object()
+_CLOSE = object()
+
+
+class WriteBehindBuffer:
+
+    def __init__(self, client, max_age=MAX_AGE, max_pending=MAX_PENDING, max_retries=MAX_BATCH_RETRIES, key_attributes=('PK', 'SK')):
+        self.client = client
+        self.max_age = max_age
+        self.max_retries = max_retries
+        self.key_attributes = key_attributes
+        self.stats = {'items': 0, 'batches': 0, 'retries': 0, 'failed': 0, 'deduplicated': 0}
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stats_lock = threading.Lock()
+        self._closed = False
+        # set once the flusher has stopped taking from the queue, whether it was closed or died
+        self._stopped = False
+        self._error = None
+        # a daemon so a buffer nobody closed can't keep the interpreter alive, the atexit hook drains it before daemon threads are stopped
+        self._flusher = threading.Thread(target=self._run, name='write-behind-flusher', daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def put(self, table_name, item, timeout=None):
+        '''Queues one item and returns a Future for it. Blocks while the queue is full, raises queue.Full if that takes longer than timeout.'''
+        self._check()
+        if self._closed:
+            raise RuntimeError('the write-behind buffer is closed')
+        future = Future()
+        self._queue.put((table_name, item, future, time.monotonic()), timeout=timeout)
+        if self._stopped:
+            # the flusher went away while we were queueing and may have missed this item
+            self._drain()
+        return future
+
+    def flush(self):
+        '''Sends whatever is waiting now and returns once everything queued before the call is written (or has failed).'''
+        self._check()
+        if not self._stopped:
+            self._queue.put(_FLUSH)
+            if self._stopped:
+                self._drain()
+        self._queue.join()
+
+    def close(self):
+        '''Sends everything still queued and waits for it. Nothing here goes through an executor, so it still works from the atexit hook.'''
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        if not self._stopped:
+            self._queue.put(_CLOSE)
+        self._flusher.join()
+        self._drain()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError('the write-behind flusher stopped with an error') from self._error
+
+    def _run(self):
+        batch = []
+        try:
+            while True:
+                timeout = None
+                if batch:
+                    timeout = max(batch[0][3] + self.max_age - time.monotonic(), 0)
+                try:
+                    entry = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    # the oldest item has waited long enough
+                    self._send(batch)
+                    batch = []
+                    continue
+
+                if entry is _FLUSH or entry is _CLOSE:
+                    self._send(batch)
+                    batch = []
+                    self._queue.task_done()
+                    if entry is _CLOSE:
+                        return
+                    continue
+
+                batch.append(entry)
+                if len(batch) == BATCH_WRITE_LIMIT:
+                    self._send(batch)
+                    batch = []
+        except BaseException as e:
+            # batch still holds anything that was being sent, none of it has been marked done yet
+            self._error = e
+            self._fail(batch, e)
+        finally:
+            self._stopped = True
+            self._drain()
+
+    def _drain(self):
+        '''Takes whatever is left in the queue once the flusher has stopped and writes it from the calling thread, or fails it if the flusher died.'''
+        entries = []
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _FLUSH or entry is _CLOSE:
+                self._queue.task_done()
+            else:
+                entries.append(entry)
+
+        for start in range(0, len(entries), BATCH_WRITE_LIMIT):
+            chunk = entries[start:start + BATCH_WRITE_LIMIT]
+            if self._error is not None:
+                self._fail(chunk, self._error)
+            else:
+                self._send(chunk)
+
+    def _fail(self, entries, error):
+        for table_name, item, future, queued_at in entries:
+            if not future.done():
+                self._count('failed')
+                future.set_exception(error)
+            self._queue.task_done()
+
+    def _send(self, batch):
+        self._write(batch)
+        for _ in batch:
+            self._queue.task_done()
+
+    def _write(self, batch):
+        if not batch:
+            return
+        pending = {}
+        try:
+            for table_name, item, future, queued_at in batch:
+                key = self._key(table_name, item)
+                if key in pending:
+                    pending[key][1].append(future)
+                    pending[key] = (item, pending[key][1])
+                    self._count('deduplicated')
+                else:
+                    pending[key] = (item, [future])
+
+            with metrics.label('WriteBehindBuffer'):
+                self._write_with_retries(pending)
+        except Exception as e:
+            for table_name, item, future, queued_at in batch:
+                if not future.done():
+                    self._count('failed')
+                    future.set_exception(e)
+
+    def _write_with_retries(self, pending):
+        attempt = 0
+        while pending:
+            request_items = {}
+            for (table_name, *_), (item, futures) in pending.items():
+                request_items.setdefault(table_name, []).append({'PutRequest': {'Item': item}})
+            response = self.client.batch_write_item(RequestItems=request_items)
+            self._count('batches')
+
+            unprocessed = set()
+            for table_name, requests in response.get('UnprocessedItems', {}).items():
+                for request in requests:
+                    unprocessed.add(self._key(table_name, request['PutRequest']['Item']))
+
+            for key in list(pending):
+                if key not in unprocessed:
+                    item, futures = pending.pop(key)
+                    self._count('items')
+                    for future in futures:
+                        future.set_result(None)
+
+            if pending:
+                attempt += 1
+                if attempt > self.max_retries:
+                    error = RuntimeError('{} items were still unprocessed after {} retries'.format(len(pending), self.max_retries))
+                    for item, futures in pending.values():
+                        self._count('failed')
+                        for future in futures:
+                            future.set_exception(error)
+                    return
+                self._count('retries')
+                backoff(attempt)
+
+    def _key(self, table_name, item):
+        # attribute values are dicts, repr makes them hashable and two equal values always repr the same
+        return (table_name,) + tuple(repr(item.get(name)) for name in self.key_attributes)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
@@ -1,11 +1,17 @@
 import datetime
-import boto3
 from botocore.exceptions import ClientError
 from botocore.exceptions import ValidationError
 import uuid
 import json
+import os
+import sys
 
-dynamodb = boto3.client('dynamodb', 'us-east-1')
+# run from anywhere, the shared helpers live in the repo root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamo_utils.client import lazy_client  # noqa: E402
+from dynamo_utils.query import iter_query, query_all  # noqa: E402
+
+dynamodb = lazy_client()
 TABLE_NAME = 'lunch_and_learn'
 
 
@@ -31,7 +37,8 @@ def put_owner(owner_name, franchise_name, owner_phone, owner_email, PPP):
 
 def get_owner(owner_name):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
             KeyConditionExpression="#pk = :pk AND #sk = :sk",
             ExpressionAttributeNames={
@@ -51,7 +58,8 @@ def get_owner(owner_name):
 
 def get_owner_and_stores(owner_name):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
             KeyConditionExpression="#pk = :pk",
             ExpressionAttributeNames={
@@ -110,7 +118,8 @@ def add_store(store_number):
 
 def get_store_with_filter(owner_name, territory, region, market, area):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
             KeyConditionExpression="#pk = :pk",
             FilterExpression="#terr = :terr AND #market = :market AND #region = :region AND #area = :area",
@@ -138,7 +147,8 @@ def get_store_with_filter(owner_name, territory, region, market, area):
 
 def get_owner_info_by_store(store, owner_name):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
             IndexName='GSI1-index',
             KeyConditionExpression="GSI1 = :GSI1",
@@ -155,7 +165,8 @@ def get_owner_info_by_store(store, owner_name):
 
 def get_owner_info_by_store_bad(store_number, owner_name):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
             KeyConditionExpression="#pk = :pk",
             FilterExpression="#store = :store_number",
@@ -175,22 +186,24 @@ def get_owner_info_by_store_bad(store_number, owner_name):
         print(e)
 
 
-def add_employee_to_store(store_number, employee_id, employee_name, employee_age, employee_role):
+def add_employee_to_store(store_number, employee_id, employee_name, employee_age, employee_role, buffer=None):
     created_at = datetime.datetime.now()
+    item = {
+        'PK': {'S': 'STORE#{}'.format(store_number.zfill(6))},
+        'SK': {'S': 'EMPLOYEE#{}'.format(employee_id)},
+        'GSI1': {'S': 'STORE#{}'.format(store_number.zfill(6))},
+        'Name': {'S': employee_name},
+        'Age': {'N': employee_age},
+        'Role': {'S': employee_role},
+        'GSI2': {'S': 'EMPLOYEE#{}'.format(employee_id)},
+        "Created_At": {"S": created_at.isoformat()},
+    }
+    if buffer is not None:
+        # queued to go out in a batch, wait on the future it returns if you need to know it was written
+        return buffer.put(TABLE_NAME, item)
+
     try:
-        result = dynamodb.put_item(
-            TableName=TABLE_NAME,
-            Item={
-                'PK': {'S': 'STORE#{}'.format(store_number.zfill(6))},
-                'SK': {'S': 'EMPLOYEE#{}'.format(employee_id)},
-                'GSI1': {'S': 'STORE#{}'.format(store_number.zfill(6))},
-                'Name': {'S': employee_name},
-                'Age': {'N': employee_age},
-                'Role': {'S': employee_role},
-                'GSI2': {'S': 'EMPLOYEE#{}'.format(employee_id)},
-                "Created_At": {"S": created_at.isoformat()},
-            }
-        )
+        result = dynamodb.put_item(TableName=TABLE_NAME, Item=item)
         print(result)
     except ClientError as e:
         print(e)
@@ -198,7 +211,8 @@ def add_employee_to_store(store_number, employee_id, employee_name, employee_age
 
 def get_employees_by_store(store_number):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
             KeyConditionExpression="#pk = :pk AND begins_with(#sk, :sk)",
             ExpressionAttributeNames={
@@ -216,9 +230,27 @@ def get_employees_by_store(store_number):
         print(e)
 
 
+def iter_employees_by_store(store_number, max_items=None):
+    return iter_query(
+        dynamodb,
+        max_items=max_items,
+        TableName=TABLE_NAME,
+        KeyConditionExpression="#pk = :pk AND begins_with(#sk, :sk)",
+        ExpressionAttributeNames={
+            "#pk": "PK",
+            "#sk": "SK"
+        },
+        ExpressionAttributeValues={
+            ":pk": {'S': 'STORE#{}'.format(store_number)},
+            ":sk": {'S': 'EMPLOYEE#'}
+        }
+    )
+
+
 def get_store_by_employeeID(employee_id):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
             IndexName='GSI2-index',
             KeyConditionExpression="GSI2 = :GSI2",
@@ -233,21 +265,23 @@ def get_store_by_employeeID(employee_id):
         print(e)
 
 
-def add_menu_items_to_store(store_number, menu_item_id, price, tax, description):
+def add_menu_items_to_store(store_number, menu_item_id, price, tax, description, buffer=None):
     created_at = datetime.datetime.now()
+    item = {
+        'PK': {'S': 'STORE#{}'.format(store_number.zfill(6))},
+        'SK': {'S': 'ITEM#{}'.format(menu_item_id)},
+        'ItemID': {'S': menu_item_id},
+        'Price': {'S': price},
+        'Tax': {'S': tax},
+        'description': {'S': description},
+        "Created_At": {"S": created_at.isoformat()},
+    }
+    if buffer is not None:
+        # queued to go out in a batch, wait on the future it returns if you need to know it was written
+        return buffer.put(TABLE_NAME, item)
+
     try:
-        result = dynamodb.put_item(
-            TableName=TABLE_NAME,
-            Item={
-                'PK': {'S': 'STORE#{}'.format(store_number.zfill(6))},
-                'SK': {'S': 'ITEM#{}'.format(menu_item_id)},
-                'ItemID': {'S': menu_item_id},
-                'Price': {'S': price},
-                'Tax': {'S': tax},
-                'description': {'S': description},
-                "Created_At": {"S": created_at.isoformat()},
-            }
-        )
+        result = dynamodb.put_item(TableName=TABLE_NAME, Item=item)
         print(result)
     except ClientError as e:
         print(e)
@@ -255,7 +289,8 @@ def add_menu_items_to_store(store_number, menu_item_id, price, tax, description)
 
 def get_items_by_store(store_number):
     try:
-        result = dynamodb.query(
+        result = query_all(
+            dynamodb,
             TableName=TABLE_NAME,
             KeyConditionExpression="#pk = :pk AND begins_with(#sk, :sk)",
             ExpressionAttributeNames={
@@ -279,6 +314,11 @@ def get_items_by_store(store_number):
 
 # get_owner_and_stores('Jonathan_Bradbury')
 
+'''from_items turns the raw items into Owner / Store objects, fields are only decoded when you read them'''
+# from dynamo_utils.models import from_items
+# owner, *stores = from_items(get_owner_and_stores('Jonathan_Bradbury')['Items'])
+# print(owner.franchise_name, [store.store_number for store in stores])
+
 # add_store_to_owner('Jonathan_Bradbury', '000017', '555-555-1514', '000017@tacobell.com',
 #                    '17 Burrito road, Mexican Pizza City, CA, 92617', 'OPEN', 'Territory1', 'Region1', 'Market1', 'Area2')
 
@@ -296,9 +336,19 @@ def get_items_by_store(store_number):
 # add_employee_to_store('000015', 'jxb7210',
 #                       'Jonathan Bradbury', '32', 'Service Champion')
 
+'''loading a whole store's staff or menu? pass a WriteBehindBuffer and the puts go out 25 at a time in the background'''
+# from dynamo_utils.writer import WriteBehindBuffer
+# with WriteBehindBuffer(dynamodb) as buffer:
+#     for number in range(100):
+#         add_employee_to_store('000015', 'emp{}'.format(number), 'Employee {}'.format(number), '20', 'Team Member', buffer=buffer)
+
 
 # get_employees_by_store('000015')
 
+'''get_employees_by_store reads every page and returns them all at once, iter_employees_by_store streams them one at a time'''
+# for employee in iter_employees_by_store('000015'):
+#     print(employee['Name']['S'])
+
 # get_store_by_employeeID('jxb7210')
 
 